@@ -0,0 +1,501 @@
+################################################################################
+#
+# Copyright 2015, Sinclair R.F., Inc.
+#
+# In-process entry point for the SSBCC 9x8 assembler.
+#
+################################################################################
+
+import argparse
+import os
+import re
+import sys
+
+import asmDef
+from asmDef_9x8 import asmDef_9x8
+from asmMetacode import Metacode
+import asmObject
+import asmOptimize
+from ssbccUtil import EvalExpr
+from ssbccUtil import SSBCCException
+from ssbccUtil import buildProfile
+
+def ArgumentParser():
+  """
+  Construct the command-line argument parser for the assembler.\n
+  Note:  This is shared by the stand-alone "asm" script and by ssbcc, which
+         constructs the same argument list and invokes the assembler in-process.
+  """
+  argListParser = argparse.ArgumentParser(description='SSBCC 9x8 assembler');
+  argListParser.add_argument('-C', metavar='CONSTANT=value', action='append', help='Constant definition');
+  argListParser.add_argument('-D', metavar='define', type=str, action='append', help='Define symbol (must start with "D_")');
+  argListParser.add_argument('-G', metavar='parametername', action='append', help='parameter names');
+  argListParser.add_argument('-I', metavar='PORT=index', action='append', help='Input port names');
+  argListParser.add_argument('-L', metavar='librarypath', action='append', help='Library search path');
+  argListParser.add_argument('-M', metavar='macropath', action='append', help='Macro search path');
+  argListParser.add_argument('-O', metavar='PORT=index', action='append', help='Output port names');
+  argListParser.add_argument('-R', metavar='PORT=index', action='append', help='Strobe-only output port names');
+  argListParser.add_argument('-S', metavar='MEMORY=length', action='append', help='Memory length');
+  argListParser.add_argument('-c', action='store_true', help='assemble the source files into a relocatable object file instead of a metafile');
+  argListParser.add_argument('--cache-dir', metavar='directory', type=str, help='save the tokens of the source files in and reuse them from this directory');
+  argListParser.add_argument('--help-macro', metavar='macroName', type=str, help='Display usage message for the specified macro');
+  argListParser.add_argument('-i', action='store_true', help='enable/require interrupt');
+  argListParser.add_argument('--list-macros', action='store_true', help='list the built-in and user-defined macros');
+  argListParser.add_argument('--map', metavar='filename', type=str, help='keep the functions at their addresses in this placement map from the previous build where possible and write the new placement to it');
+  argListParser.add_argument('--max-length', metavar='N', type=int, help='with --map, the size of the instruction memory, i.e., the maximum program length');
+  argListParser.add_argument('--optimize', metavar='LEVEL', type=int, default=0, choices=(0,1,2,3,), help='optimization level:  0 for none (default), 1 for peephole rewrites of the function bodies, 2 to also convert tail calls to jumps, or 3 to also thread jumps and place functions to fall through into the functions they tail call');
+  argListParser.add_argument('-q', action='store_true', help='quiet:  do not report the placement and optimization of the functions');
+  argListParser.add_argument('-o', metavar='outfile', type=str, required=True, help='output metafile or, with "-c", object file');
+  argListParser.add_argument('--cprofile', metavar='filename', type=str, help='write cProfile statistics for the run to this file');
+  argListParser.add_argument('--profile', metavar='filename', type=str, help='write the wall and CPU times of the assembler stages to this JSON file');
+  argListParser.add_argument('-s', metavar='STACK_NAME=length', action='append', help='Stack length');
+  argListParser.add_argument('filename', metavar='filename', nargs='+', type=str, help='required list of source files and "%s" object files' % asmObject.OBJECT_SUFFIX);
+  return argListParser;
+
+def ParseArguments(args):
+  """
+  Convert the list of argument strings into the argument object required by
+  Assemble.
+  """
+  return ArgumentParser().parse_args(args);
+
+################################################################################
+#
+# Terminating help messages
+#
+################################################################################
+
+def HelpMacro(ad,macroName):
+  """
+  Print the usage for the specified macro.
+  """
+  if macroName[0] != '.':
+    macroName = '.%s' % macroName
+  if macroName not in ad.macros:
+    try:
+      ad.AddUserMacro(macroName[1:])
+    except:
+      pass
+  if macroName in ad.macros:
+    if ad.macros[macroName].doc:
+      print '\n%s usage message:' % macroName
+      print ad.macros[macroName].doc
+    else:
+      print '\nNo usage message for %s\n' % macroName
+  else:
+    print 'Macro "%s" not recognized or malformed' % macroName
+
+def ListMacros(ad):
+  """
+  List the built-in macros and the user-defined macros in the macro search
+  paths.
+  """
+  print '\nBuilt-in macros\n'
+  tmp = [name for name in ad.macros if ad.macros[name].builtIn]
+  tmp.sort()
+  for name in tmp:
+    print name
+  for testPath in ad.macroSearchPaths:
+    if not os.path.isdir(testPath):
+      continue
+    for testName in os.listdir(testPath):
+      if not re.match(r'.*\.py$',testName):
+        continue;
+      fullFile = os.path.join(testPath,testName);
+      if not os.path.isfile(fullFile):
+        continue
+      try:
+        execfile(fullFile)
+        exec('%s(ad)' % testName[:-3])
+      except:
+        pass
+  print '\nUser-defined macros\n'
+  tmp = [name for name in ad.macros if not ad.macros[name].builtIn]
+  tmp.sort()
+  for name in tmp:
+    print name
+  print
+
+################################################################################
+#
+# Parse the source files.
+#
+################################################################################
+
+def AssembleFiles(ad,fbi):
+  """
+  Parse the directive bodies in the source files (including ".include"d files)
+  provided by the iterator and incorporate them into the assembler
+  dictionaries.\n
+  Note:  This is the first stage of the assembler (see Assemble).
+  """
+  ifstackStack = list();
+  ifstack = None;
+  for bl in fbi:
+    filename = bl[0];
+    startLine = bl[1];
+    body = bl[2:];
+    flc_loc = filename + ' at line ' + str(startLine+len(body)-1);
+    lastLine = body[-1][0] if body else None;
+    # Start-of-file processing.
+    if startLine == 0:
+      if ifstack != None:
+        ifstackStack.append(ifstack);
+      ifstack = list();
+    # End-of-file processing.
+    elif startLine == -1:
+      if len(ifstack) != 0:
+        raise asmDef.AsmException('%d unmatched .IFDEF/.IFNDEF(s) at the end of %s' % (len(ifstack),filename,));
+      if ifstackStack:
+        ifstack = ifstackStack.pop();
+      else:
+        ifstack = None;
+    # Handle conditional compilation directives.
+    elif re.match(r'\s*\.ELSE\b',lastLine):
+      if not re.match(r'\s*\.ELSE\s*(;.*)?$',lastLine):
+        raise asmDef.AsmException('Malformed ".ELSE" in %s' % flc_loc);
+      if not ifstack:
+        raise asmDef.AsmException('Unmatched ".ELSE" in %s' % flc_loc);
+      ifstack[-1] ^= True;
+    elif re.match(r'\s*\.ENDIF\b',lastLine):
+      if not re.match(r'\s*\.ENDIF\s*(;.*)?$',lastLine):
+        raise asmDef.AsmException('Malformed ".ENDIF" in %s' % flc_loc);
+      if not ifstack:
+        raise asmDef.AsmException('Unmatched ".ENDIF" in %s' % flc_loc);
+      ifstack.pop();
+    elif re.match(r'\s*\.IFN?DEF\b',lastLine):
+      a = re.findall(r'\s*(\.IFN?DEF)\s*(\S+)\b\s*(;.*)?$',lastLine);
+      if not a:
+        raise asmDef.AsmException('Malformed .IFDEF or .IFNDEF in %s' % flc_loc);
+      a = a[0];
+      ifstack.append(ad.IsSymbol(a[1]));
+      if fbi.consultations != None:
+        fbi.consultations.append(('symbol',a[1],ifstack[-1],));
+      if a[0] == '.IFNDEF':
+        ifstack[-1] ^= True;
+    # Ignore bodies rejected by conditional compilation.
+    elif ifstack and not ifstack[-1]:
+      pass;
+    # ".include" directives don't have an associated body
+    elif re.match(r'\s*\.include\s',lastLine):
+      a = re.findall(r'\s*\.include\s+(\S+)(\s*|\s*;.*)$',lastLine);
+      if not a:
+        raise asmDef.AsmException('Malformed .include directive in %s' % flc_loc);
+      a = a[0];
+      fbi.Include(a[0]);
+    # Parse the body of all other directives and ensure that only one ".main"
+    # and one ".interrupt" are defined.
+    else:
+      rawTokens = fbi.RawTokens();
+      if not rawTokens:
+        continue;
+      ad.CheckRawTokens(rawTokens);
+      ad.FillRawTokens(rawTokens);
+
+################################################################################
+#
+# Run the assembler.
+#
+################################################################################
+
+def ReportLayout(ad,relayout,optimization):
+  """
+  Print the reason for a full relayout of a stable placement and the savings
+  made by the optimization, including the placement of functions to fall
+  through into the functions they tail call (see asmOptimize.Optimize and
+  asmOptimize.FallThrough).
+  """
+  if relayout:
+    print 'Full relayout of the program:  %s' % relayout;
+  saved = [entry for entry in optimization['saved'] if entry[0] in ad.callGraph];
+  # Include the tail calls removed by placing the callers immediately before
+  # the called functions.
+  for caller,callee,nRemoved in ad.fallThroughs:
+    for entry in saved:
+      if entry[0] == caller:
+        break;
+    else:
+      entry = [caller,ad.callGraph[caller].length+nRemoved,None,list()];
+      saved.append(entry);
+    entry[2] = ad.callGraph[caller].length;
+    entry[3] = entry[3] + ['falls through into %s' % callee];
+  if saved:
+    print 'Optimization saved %d instructions:' % sum(before-after for name,before,after,notes in saved);
+    for name,before,after,notes in saved:
+      print '  %-24s %5d -> %5d%s' % (name,before,after,'  (%s)' % ', '.join(notes) if notes else '',);
+  if optimization['depth']:
+    before,after = optimization['depth'];
+    if (before != None) and (after < before):
+      print 'Tail calls reduced the return stack depth for calls from %d to %d' % (before,after,);
+
+def Assemble(argList,dependencies=None):
+  """
+  Assemble the files listed in the argument object (see ArgumentParser) and
+  return the memories and program as an asmMetacode.Metacode object or, with
+  the "-c" option, return the relocatable asmObject.Object for the source
+  files.\n
+  If provided, the names of the source files, including the ".include"d files,
+  and of the macro files read by the assembler are appended to the list
+  "dependencies".\n
+  Errors in the assembly source are raised as asmDef.AsmException.
+  """
+
+  # Construct the keyword parser
+  ad = asmDef_9x8(True if argList.i else False);
+
+  # Record the constants in the program symbol table.
+  if argList.C:
+    for constant in argList.C:
+      a=re.findall(r'^(C_\w+)=(-?[1-9]\d*|\w+)$',constant);
+      if not a:
+        raise asmDef.AsmException('Malformed -C argument: "%s"' % constant);
+      a = list(a[0]);
+      try:
+        a[1] = EvalExpr(a[1]);
+      except SSBCCException:
+        raise asmDef.AsmException('Cannot evaluate "%s"' % a[1]);
+      if ad.IsSymbol(a[0]):
+        raise asmDef.AsmException('Command line constant "%s" already defined' % a[0]);
+      ad.AddSymbol(a[0], 'constant', body=[a[1]]);
+
+  # Record the defines.
+  if argList.D:
+    for name in argList.D:
+      if not re.match('D_',name):
+        raise asmDef.AsmException('Argument "%s" to "%s" should start with "D_"' % (name,sys.argv[0],));
+      ad.AddSymbol(name, 'define');
+
+  # Record the input names and values in the appropriate record type
+  if argList.G:
+    for parameter in argList.G:
+      a = re.findall(r'^([LG]_\w+)$',parameter);
+      if not a:
+        raise asmDef.AsmException('Malformed -G argument: "%s"' % parameter);
+      if ad.IsSymbol(a[0]):
+        raise asmDef.AsmException('Program Bug -- repeated symbol "%s"' % a[0]);
+      ad.RegisterParameterName(a[0]);
+  if argList.I:
+    for inport in argList.I:
+      a=re.findall(r'^(I_\w+)=(0|[1-9]\d*)$',inport);
+      if not a:
+        raise asmDef.AsmException('Malformed -I argument: "%s"' % inport);
+      a = a[0];
+      if ad.IsSymbol(a[0]):
+        raise Exception('Program Bug -- repeated symbol "%s"' % a[0]);
+      ix = int(a[1]);
+      if not (0 <= ix < 256):
+        raise asmDef.AsmException('Out-of-range inport index:  "%s"' % inport);
+      ad.RegisterInport(a[0],ix);
+  if argList.O:
+    for outport in argList.O:
+      a=re.findall(r'^(O_\w+)=(0|[1-9]\d*)$',outport);
+      if not a:
+        raise asmDef.AsmException('Malformed -O argument: "%s"' % outport);
+      a = a[0];
+      if ad.IsSymbol(a[0]):
+        raise asmDef.AsmException('Program Bug -- repeated symbol "%s"' % a[0]);
+      ix = int(a[1]);
+      if not (0 <= ix < 256):
+        raise asmDef.AsmException('Out-of-range outport index:  "%s"' % outport);
+      ad.RegisterOutport(a[0],ix);
+  if argList.R:
+    for outstrobe in argList.R:
+      a=re.findall(r'^(O_\w+)=(0|[1-9]\d*)$',outstrobe);
+      if not a:
+        raise asmDef.AsmException('Malformed -R argument: "%s"' % outstrobe);
+      a = a[0];
+      if ad.IsSymbol(a[0]):
+        raise asmDef.AsmException('Program Bug -- repeated symbol "%s"' % a[0]);
+      ix = int(a[1]);
+      if not (0 <= ix < 256):
+        raise asmDef.AsmException('Out-of-range strobe-only outport index:  "%s"' % outstrobe);
+      ad.RegisterOutstrobe(a[0],ix);
+  if argList.S:
+    for memory in argList.S:
+      a=re.findall(r'^(\w+)=(0|[1-9]\d*)$',memory);
+      if not a:
+        raise asmDef.AsmException('Malformed -S argument: "%s"' % memory);
+      a=a[0];
+      length = int(a[1]);
+      if not (0 < length <= 256):
+        raise asmDef.AsmException('Out-of-range memory length:  "%s"' % memory);
+      ad.RegisterMemoryLength(a[0],length);
+  if argList.s:
+    for stack in argList.s:
+      a=re.findall(r'^(\w+)=(0|[1-9]\d*)$',stack);
+      if not a:
+        raise asmDef.AsmException('Malformed -s argument: "%s"' % stack);
+      a = a[0];
+      ad.RegisterStackLength(a[0],int(a[1]));
+
+  # Add paths for the ".macro" directive.
+  if argList.M:
+    for path in argList.M:
+      ad.AddMacroSearchPath(path);
+
+  # If asked, print the usage for the specified macro or list the available
+  # macros.
+  if argList.help_macro:
+    HelpMacro(ad,argList.help_macro);
+    raise asmDef.AsmException('Assembler terminated by "--help-macro" option');
+  if argList.list_macros:
+    ListMacros(ad);
+    raise asmDef.AsmException('Assembler terminated by "--list-macros" option');
+
+  ################################################################################
+  #
+  # Stage 1:  Parse the files.
+  #
+  # Read the entire file, doing the following while reading the file:
+  # - Store the raw content of each line or group of lines for output to the
+  #   assembled memory initialization.
+  #   Note: A group of lines consists the comment lines preceding a directive and
+  #         the body of the directive.
+  # - Convert group of lines into an array of the raw tokens.
+  # - Check the integrity of the bodies defined by the list of raw tokens.
+  # - For each array of raw tokens, incorporate already-defined symbols and update
+  #   the assembler dictionaries.
+  #   Note: At this point the space required for the function or main program
+  #     is fully computed.
+  #
+  # Object files are linked in place of their source files.  With "-c", the
+  # object files are imported, must precede the source files, and the result of
+  # this stage for the source files is the output object.
+  #
+  ################################################################################
+
+  buildProfile.StartStage('assembler stage 1');
+  sourceFiles = list();
+  obj = None;
+  ixFile = 0;
+  while ixFile < len(argList.filename):
+    filename = argList.filename[ixFile];
+    if filename in argList.filename[:ixFile]:
+      raise asmDef.AsmException('Input file %s listed more than once' % filename);
+    # Link object files.
+    if asmObject.IsObjectFile(filename):
+      if obj:
+        raise asmDef.AsmException('Object file "%s" must precede the source files' % filename);
+      asmObject.ReadObject(filename).Link(ad);
+      sourceFiles.append(filename);
+      ixFile = ixFile + 1;
+      continue;
+    # Construct the iterator that loops through the code bodies of the
+    # following source files.
+    fps = list();
+    while (ixFile < len(argList.filename)) and not asmObject.IsObjectFile(argList.filename[ixFile]):
+      try:
+        fps.append(open(argList.filename[ixFile],'r'));
+      except:
+        raise asmDef.AsmException('Error opening "%s"' % argList.filename[ixFile]);
+      ixFile = ixFile + 1;
+    fbi = asmDef.FileBodyIterator(fps,ad,argList.cache_dir);
+    # Add paths for the ".include" directive.
+    if argList.L:
+      for path in argList.L:
+        fbi.AddSearchPath(path);
+    # Record the environment and the consultations for the object.
+    if argList.c:
+      obj = asmObject.Object(argList.o);
+      obj.Begin(ad);
+      fbi.consultations = list();
+    AssembleFiles(ad,fbi);
+    fbi.SaveCache();
+    sourceFiles += fbi.sourceFiles;
+    if obj:
+      obj.End(ad,fbi.sourceFiles,fbi.consultations);
+
+  buildProfile.EndStage();
+
+  # Read the placement map from the previous build.
+  mapText = None;
+  previous = None;
+  if argList.map and not argList.c and os.path.isfile(argList.map):
+    try:
+      mapText = open(argList.map,'rt').read();
+    except:
+      raise asmDef.AsmException('Error opening "%s"' % argList.map);
+    sourceFiles.append(argList.map);
+    previous = asmDef.ReadPlacementMap(mapText);
+    if (previous == None) and not argList.q:
+      print 'Full relayout of the program:  "%s" is not a placement map' % argList.map;
+
+  if dependencies != None:
+    for filename in sourceFiles + ad.macroFiles:
+      if filename not in dependencies:
+        dependencies.append(filename);
+
+  if argList.c:
+    if not obj:
+      raise asmDef.AsmException('No source file to assemble into "%s"' % argList.o);
+    return obj;
+
+  #
+  # Ensure a ".main" body was declared.
+  #
+
+  if not ad.Main():
+    raise asmDef.AsmException('Required ".main" body not provided');
+
+  #
+  # Enforce consistency between the command-line "-i" flag and whether or not an
+  # ".interrupt" body was declared.
+  #
+
+  if argList.i and not ad.Interrupt():
+    raise asmDef.AsmException('Required ".interrupt" body not provided');
+  if not argList.i and ad.Interrupt():
+    raise asmDef.AsmException('".interrupt" body not allowed near %s' % ad.Interrupt()[0]['loc']);
+
+  ################################################################################
+  #
+  # Stage 2:  Optionally optimize the function bodies, identify the required
+  # functions, compute their addresses, and set the addresses for all "jump"
+  # and "call" macros.
+  #
+  # With a placement map from the previous build, the functions are kept at
+  # their previous addresses where possible so that changing a function only
+  # changes the instructions that depend on it.
+  #
+  ################################################################################
+
+  buildProfile.StartStage('assembler stage 2');
+  ad.EvaluateMemoryTree();
+  optimization = asmOptimize.Optimize(ad,argList.optimize);
+  relayout = ad.EvaluateFunctionTree(previous,argList.max_length,(argList.optimize >= 3) and not argList.map);
+  if not argList.q:
+    ReportLayout(ad,relayout,optimization);
+  buildProfile.EndStage();
+
+  ################################################################################
+  #
+  # Stage 3:  Emit the program
+  #
+  # Do the following:
+  # - If interrupts are enabled, then set the first 4 instructions to be a "dis"
+  #   and a ".jump" instruction to the ".interrupt" function.
+  # - Write the instructions for the ".main" body.
+  # - Loop through the ".function" list in the order in which they were defined
+  #   and write their instructions.
+  # - Print the memory and instruction usage statistics.
+  #
+  ################################################################################
+
+  buildProfile.StartStage('assembler stage 3');
+  metacode = Metacode();
+  ad.EmitMemories(metacode);
+  ad.EmitProgram(metacode);
+  buildProfile.EndStage();
+
+  # Save the placement of the functions for the next build.
+  if argList.map:
+    newMapText = ad.callGraph.PlacementMap();
+    if newMapText != mapText:
+      try:
+        fpMap = open(argList.map,'wt');
+        fpMap.write(newMapText);
+        fpMap.close();
+      except:
+        raise asmDef.AsmException('Error writing "%s"' % argList.map);
+
+  return metacode;
@@ -6,9 +6,15 @@
 #
 ################################################################################
 
+import hashlib
+import json
 import os
 import re
 
+import ssbccCache
+from ssbccUtil import EvalExpr
+from ssbccUtil import SSBCCException
+
 class AsmException(Exception):
   """
   Exception class for the assembler.\n
@@ -21,42 +27,345 @@ class AsmException(Exception):
   def __str__(self):
     return self.msg;
 
+class Macro(object):
+  """
+  Entry in the macro table:  the name of the macro, its length or the function
+  computing the length of variable-length macros, the allowed types and
+  defaults of its arguments, the range of the allowed number of arguments, its
+  doc string, and whether or not it is built in to the assembler.
+  """
+  __slots__ = ('name','length','args','nArgs','doc','builtIn',);
+
+  def __init__(self,name,length,args,nArgs,doc):
+    self.name = name;
+    self.length = length;
+    self.args = args;
+    self.nArgs = nArgs;
+    self.doc = doc;
+    self.builtIn = False;
+
+class Symbol(object):
+  """
+  Entry in the symbol table:  the name of the symbol, its type (constant,
+  function, inport, RAM, variable, ...), its type-specific body, and the
+  location of its definition (None for symbols defined on the command line).
+  """
+  __slots__ = ('name','type','body','loc',);
+
+  def __init__(self,name,stype,body,loc):
+    self.name = name;
+    self.type = stype;
+    self.body = body;
+    self.loc = loc;
+
+class SymbolTable:
+  """
+  Symbol table for the assembler.\n
+  The symbols are indexed by their names.  The symbols are also listed in the
+  order in which they were defined, both all together and by type.
+  """
+
+  def __init__(self):
+    self.entries = dict();
+    self.ordered = list();
+    self.byType = dict();
+
+  def __contains__(self,name):
+    return name in self.entries;
+
+  def __getitem__(self,name):
+    return self.entries[name];
+
+  def __len__(self):
+    return len(self.ordered);
+
+  def Add(self,name,stype,body=None,loc=None):
+    """
+    Add the symbol to the table and return its entry.
+    """
+    if name in self.entries:
+      raise Exception('Program Bug -- symbol "%s" already in table' % name);
+    symbol = Symbol(name,stype,body,loc);
+    self.entries[name] = symbol;
+    self.ordered.append(symbol);
+    self.byType.setdefault(stype,list()).append(symbol);
+    return symbol;
+
+  def All(self):
+    """
+    Return the list of the symbols in the order in which they were defined.
+    """
+    return self.ordered;
+
+  def OfType(self,stype):
+    """
+    Return the list of the symbols of the specified type in the order in which
+    they were defined.
+    """
+    return self.byType.get(stype,list());
+
+class Function(object):
+  """
+  Node in the call graph:  the name of the required function, its length, its
+  body, its start address, the addresses of its labels, the functions it calls
+  and the functions calling it (each listed once in the order first
+  encountered), and its call depth, i.e., the minimum number of nested calls
+  from ".main" or ".interrupt" required to reach it.
+  """
+  __slots__ = ('name','length','body','address','labels','callees','callers','depth',);
+
+  def __init__(self,name,length,body,address,depth):
+    self.name = name;
+    self.length = length;
+    self.body = body;
+    self.address = address;
+    self.labels = dict();
+    self.callees = list();
+    self.callers = list();
+    self.depth = depth;
+
+class CallGraph:
+  """
+  Call graph of the functions required by the program.\n
+  The functions are listed in the order in which they were added, unless they
+  are reordered by Reorder, and are indexed by their names.  The functions are
+  placed one after the other in this order with the first function starting
+  at the specified address unless they are moved by PlaceStable.
+  """
+
+  def __init__(self,start=0):
+    self.start = start;
+    self.length = start;
+    self.entries = dict();
+    self.ordered = list();
+    self.calls = set();
+
+  def __contains__(self,name):
+    return name in self.entries;
+
+  def __getitem__(self,name):
+    return self.entries[name];
+
+  def __iter__(self):
+    return iter(self.ordered);
+
+  def __len__(self):
+    return len(self.ordered);
+
+  def Add(self,name,length,body,depth):
+    """
+    Append the function to the program and return its node.
+    """
+    if name in self.entries:
+      raise Exception('Program Bug -- function "%s" already in call graph' % name);
+    function = Function(name,length,body,self.length,depth);
+    self.entries[name] = function;
+    self.ordered.append(function);
+    self.length = self.length + length;
+    return function;
+
+  def AddCall(self,caller,callee):
+    """
+    Record a call from the function named "caller" to the function named
+    "callee".
+    """
+    if (caller,callee,) in self.calls:
+      return;
+    self.calls.add((caller,callee,));
+    self.entries[caller].callees.append(callee);
+    self.entries[callee].callers.append(caller);
+
+  def Address(self,name):
+    """
+    Return the start address of the named function.
+    """
+    return self.entries[name].address;
+
+  def Callees(self,name):
+    """
+    Return the list of the functions called by the named function.
+    """
+    return self.entries[name].callees;
+
+  def Callers(self,name):
+    """
+    Return the list of the functions calling the named function.
+    """
+    return self.entries[name].callers;
+
+  def Depth(self,name):
+    """
+    Return the call depth of the named function.
+    """
+    return self.entries[name].depth;
+
+  def ByAddress(self):
+    """
+    Return the list of the functions in address order.
+    """
+    return sorted(self.ordered, key=lambda function : function.address);
+
+  def End(self):
+    """
+    Return the address following the last function, i.e., the program length.
+    """
+    return self.length;
+
+  def Reorder(self,names):
+    """
+    List the functions in the order of the list of their names and place them
+    one after the other in this order.\n
+    Note:  The first function must be unchanged since it starts the program.
+    """
+    if (len(names) != len(self.ordered)) or (names[0] != self.ordered[0].name):
+      raise Exception('Program Bug -- invalid function order');
+    self.ordered = [self.entries[name] for name in names];
+    self.length = self.start;
+    for function in self.ordered:
+      function.address = self.length;
+      self.length = self.length + function.length;
+
+  def PlaceStable(self,previous,limit):
+    """
+    Place the functions at their addresses in a previous placement where
+    possible.\n
+    previous    dict of the [address, length] lists of the previously placed
+                functions indexed by their names
+    limit       maximum allowed program length\n
+    The first function stays at the start address.  The other functions stay
+    at their previous addresses unless they would then overlap the first
+    function or grow into the previously following function.  The remaining
+    functions are placed, in order, in the first gap large enough to hold them
+    or at the end of the program.  The gaps left in the program are padding.\n
+    If the program would be longer than the limit, then the functions are left
+    one after the other and the reason for the full relayout is returned.
+    Otherwise None is returned.
+    """
+    first = self.ordered[0];
+    firstEnd = first.address + first.length;
+    # Keep the functions that still fit at their previous addresses.
+    candidates = sorted([function for function in self.ordered[1:] if function.name in previous], key=lambda function : previous[function.name][0]);
+    placed = [(first.address,firstEnd,)];
+    addresses = dict();
+    lastEnd = self.start;
+    for ixCandidate in range(len(candidates)):
+      function = candidates[ixCandidate];
+      address = previous[function.name][0];
+      end = address + function.length;
+      if (address < lastEnd) or ((address < firstEnd) and (first.address < end)):
+        continue;
+      if (ixCandidate+1 < len(candidates)) and (end > previous[candidates[ixCandidate+1].name][0]):
+        continue;
+      placed.append((address,end,));
+      addresses[function.name] = address;
+      lastEnd = end;
+    # Put the other functions in the gaps between the kept functions.
+    placed.sort();
+    gaps = list();
+    for ixPlaced in range(1,len(placed)):
+      if placed[ixPlaced-1][1] < placed[ixPlaced][0]:
+        gaps.append([placed[ixPlaced-1][1],placed[ixPlaced][0]]);
+    length = max(end for (address,end) in placed);
+    for function in self.ordered[1:]:
+      if function.name in addresses:
+        continue;
+      for gap in gaps:
+        if gap[1] - gap[0] >= function.length:
+          addresses[function.name] = gap[0];
+          gap[0] = gap[0] + function.length;
+          break;
+      else:
+        addresses[function.name] = length;
+        length = length + function.length;
+    if length > limit:
+      return 'the stable placement requires %d instructions but only %d are available' % (length,limit,);
+    for function in self.ordered[1:]:
+      function.address = addresses[function.name];
+    self.length = length;
+    return None;
+
+  def PlacementMap(self):
+    """
+    Return the text of the placement map, i.e., the name, address, and length
+    of each function in address order (see ReadPlacementMap).
+    """
+    lines = [json.dumps(dict(format=PLACEMENT_MAP_FORMAT, version=PLACEMENT_MAP_VERSION), sort_keys=True, separators=(',',':'))];
+    for function in self.ByAddress():
+      lines.append(json.dumps(dict(function=dict(name=function.name, address=function.address, length=function.length)), sort_keys=True, separators=(',',':')));
+    return '\n'.join(lines) + '\n';
+
+# Identification and version of the placement map file format.
+PLACEMENT_MAP_FORMAT = 'ssbcc-9x8-map';
+PLACEMENT_MAP_VERSION = 1;
+
+def ReadPlacementMap(text):
+  """
+  Convert the text of a placement map written by CallGraph.PlacementMap into a
+  dict of the [address, length] lists of the functions indexed by their names
+  or return None if the text is not a placement map.
+  """
+  previous = dict();
+  try:
+    lines = text.splitlines();
+    header = json.loads(lines[0]);
+    if (header.get('format') != PLACEMENT_MAP_FORMAT) or (header.get('version') != PLACEMENT_MAP_VERSION):
+      return None;
+    for line in lines[1:]:
+      function = json.loads(line)['function'];
+      previous[str(function['name'])] = [function['address'],function['length']];
+  except (IndexError,KeyError,TypeError,ValueError):
+    return None;
+  return previous;
+
 class FileBodyIterator:
   """
   Iterator for files that returns bodies of lines of the file.\n
   The directive must be the first non-white spaces on a line.\n
   The iterator outputs a list whos first element is the line number for the
   first line of the block and whose subsequent elements are the lines with the
-  content of the block.\n
-  The iterator handles the ".include" directive.
+  content of the block.  Each line is split into its tokens by LexLine as it is
+  read and is provided as the tuple (line,tokens).\n
+  The iterator handles the ".include" directive.\n
+  If a cache directory is provided, then the bodies of each file and the raw
+  tokens generated for them by RawTokens are saved in the cache directory and
+  are reused by later assemblies of the unchanged file (see the RawTokens
+  method).
   """
 
-  def __init__(self, fps, ad):
+  # Maximum number of sets of raw tokens remembered for each body.
+  maxParses = 4;
+
+  def __init__(self, fps, ad, cacheDir=None):
     """
     Initialize the iterator.\n
     fps         list of file pointers from the argument line
     ad          asmDef_9x8 object (required to identify the directives)
+    cacheDir    optional directory for saving and reusing the file bodies and
+                their raw tokens
     """
     # Do sanity check on arguments.
     if ad.IsDirective(".include"):
       raise Exception('Program Bug:  The ".include" directive is defined by FileBodyIterator');
     # Initialize the raw processing states
-    self.ixConstants = 0;
     self.fpPending = list(fps);
     self.ad = ad;
-    self.current = list();
-    self.pending = list();
+    self.cacheDir = cacheDir;
+    self.cachedFiles = list();
+    # Optional list of the consultations made while generating the raw tokens
+    # (see RawTokens).
+    self.consultations = None;
     # Initialize the include search paths
     self.searchPaths = list();
     self.searchPaths.append('.');
     # Prepare the file parsing
     self.included = list();
+    self.sourceFiles = list();
     for fp in self.fpPending:
       if fp.name in self.included:
         raise AsmException('Input file %s listed more than once' % fp.name);
       self.included.append(fp.name);
-    self.fpStack = list();
-    self.fpStack.append(dict(fp=self.fpPending.pop(0), line=0));
+      self.sourceFiles.append(fp.name);
+    self.fileStack = list();
     self.pendingInclude = None;
 
   def __iter__(self):
@@ -71,109 +380,107 @@ class FileBodyIterator:
     The body is a list with the following content:
       the name of the file
       the line number for the first line of the body
-      the body consisting of lines from the source file\n
+      the body consisting of (line,tokens) tuples for the lines from the source
+        file where tokens is the list of tokens from LexLine\n
     The body contains comment lines preceding the directive, the line with the
     directive, and optional lines following the directive up to the optional
-    comments preceding the next directive.
-    """
-    # Discard the body emitted by the previous call.
-    self.current = self.pending;
-    self.pending = list();
-    # If the current body is an include directive, then process it immediately.
-    if self.current and re.match(r'\s*\.include\b',self.current[-1]):
-      return self.current;
-    # Loop until all of the files have been processed
-    while self.fpStack or self.fpPending or self.pendingInclude:
-      # Indicate when a new file is started.
-      if 'started' not in self.fpStack[-1]:
-        if  not self.current:
-          self.fpStack[-1]['started'] = True;
-          self.current.append(self.fpStack[-1]['fp'].name);
-          self.current.append(0);
-        return self.current;
-      # Ensure the bodies in closed files are all emitted before continuing to
-      # the next/enclosing file.
-      if 'closed' in self.fpStack[-1]:
-        # Provide end-of-file indication if there is not a pending body fragment.
-        if not self.current:
-          self.current.append(self.fpStack[-1]['fp'].name);
-          self.current.append(-1);
-          self.fpStack.pop();
-        return self.current;
-      # Handle a queued ".include" directive.
-      if self.pendingInclude:
-        # Don't open the include file until all previous content has been emitted.
-        if self.current:
-          return self.current;
-        self.included.append(self.pendingInclude);
-        fp_pending = None;
-        for path in self.searchPaths:
-          fullInclude = os.path.join(path,self.pendingInclude);
-          if os.path.exists(fullInclude):
-            fp_pending = open('%s/%s' % (path,self.pendingInclude),'rt');
-            break;
-        else:
-          raise AsmException('%s not found' % self.pendingInclude);
-        self.fpStack.append(dict(fp=fp_pending, line=0));
-        self.pendingInclude = None;
-        # Provide start-of-file indication.
-        self.fpStack[-1]['started'] = True;
-        self.current.append(fp_pending.name);
-        self.current.append(0);
-        return self.current;
-      # Get the next file to process if fpStack is empty.
-      if not self.fpStack:
-        self.fpStack.append(dict(fp=self.fpPending.pop(0), line=0));
-      # Process/continue processing the top file.
-      fp = self.fpStack[-1];
-      for line in fp['fp']:
-        fp['line'] += 1;
-        # Handle single-line directives.
-        if re.match(r'\s*\.(IFDEF|IFNDEF|ELSE|ENDIF|include)\b',line):
-          if not self.pending:
-            self.pending.append(fp['fp'].name);
-            self.pending.append(fp['line']);
-          self.pending.append(line);
-          if not self.current:
-            self.current = self.pending;
-            self.pending = list();
-          return self.current;
-        # Append empty and comment lines to the pending block.
-        if re.match(r'\s*(;|$)', line):
-          if not self.pending:
-            self.pending.append(fp['fp'].name);
-            self.pending.append(fp['line']);
-          self.pending.append(line);
-          continue;
-        # See if the line starts with a directive.
-        tokens = re.findall(r'\s*(\S+)',line);
-        if self.ad.IsDirective(tokens[0]):
-          if not self.pending:
-            self.pending.append(fp['fp'].name);
-            self.pending.append(fp['line']);
-          self.pending.append(line);
-          if self.current:
-            return self.current;
-          self.current = self.pending;
-          self.pending = list();
-          continue;
-        # Otherwise, this line belongs to the body of the preceding directive.
-        if not self.pending:
-          self.pending.append(fp['fp'].name);
-          self.pending.append(fp['line']);
-        if not self.current:
-          self.current += self.pending[0:2];
-        self.current += self.pending[2:];
-        self.current.append(line);
-        self.pending = list();
-      # Past the last line of the current file -- close it.
-      self.fpStack[-1]['fp'].close();
-      self.fpStack[-1]['closed'] = True;
-      # Prepare to emit pending bodies if any.
-      if not self.current:
-        self.current = self.pending;
-        self.pending = list();
-    raise StopIteration;
+    comments preceding the next directive.\n
+    The start and the end of each file are indicated by the line numbers 0 and
+    -1 respectively with no body.
+    """
+    # Handle a queued ".include" directive.
+    if self.pendingInclude:
+      self.included.append(self.pendingInclude);
+      for path in self.searchPaths:
+        fullInclude = os.path.join(path,self.pendingInclude);
+        if os.path.exists(fullInclude):
+          fp = open('%s/%s' % (path,self.pendingInclude),'rt');
+          break;
+      else:
+        raise AsmException('%s not found' % self.pendingInclude);
+      self.sourceFiles.append(fp.name);
+      self.pendingInclude = None;
+      return self.StartFile(fp);
+    # Get the next file to process if all of the previous files have been
+    # processed.
+    if not self.fileStack:
+      if not self.fpPending:
+        raise StopIteration;
+      return self.StartFile(self.fpPending.pop(0));
+    # Emit the next body of the current file or indicate the end of the file.
+    thisFile = self.fileStack[-1];
+    if thisFile['ixBody'] < len(thisFile['bodies']):
+      body = thisFile['bodies'][thisFile['ixBody']];
+      thisFile['ixBody'] += 1;
+      return [thisFile['name']] + body;
+    self.fileStack.pop();
+    return [thisFile['name'],-1];
+
+  def StartFile(self,fp):
+    """
+    Read the file, split it into its bodies or get its bodies from the cache,
+    and provide the start-of-file indication.
+    """
+    lines = fp.readlines();
+    fp.close();
+    thisFile = dict(name=fp.name, ixBody=0, parses=dict(), changed=False);
+    if self.cacheDir:
+      thisFile['objectName'] = 'asm-%s' % hashlib.sha1(json.dumps([ParseCacheVersion(),fp.name,hashlib.sha1(''.join(lines)).hexdigest()])).hexdigest();
+      cached = ssbccCache.ReadObject(self.cacheDir,thisFile['objectName']);
+      if cached:
+        thisFile['bodies'] = cached['bodies'];
+        thisFile['parses'] = cached['parses'];
+      self.cachedFiles.append(thisFile);
+    if 'bodies' not in thisFile:
+      thisFile['bodies'] = FileBodies(self.ad,lines);
+      thisFile['changed'] = True;
+    self.fileStack.append(thisFile);
+    return [fp.name,0];
+
+  def RawTokens(self):
+    """
+    Return the list of raw tokens for the body most recently returned by the
+    iterator (see the function RawTokens).\n
+    Note:  The raw tokens depend on the symbols consulted by .ifdef and
+           .ifndef, on the values of "${...}" expressions and repeat counts,
+           and on the definitions of the macros.  Raw tokens from the cache are
+           only reused if all of these are unchanged.\n
+    Note:  If the "consultations" attribute is a list, then these
+           consultations are appended to it.
+    """
+    thisFile = self.fileStack[-1];
+    ixBody = thisFile['ixBody'] - 1;
+    body = thisFile['bodies'][ixBody];
+    if not self.cacheDir:
+      return RawTokens(self.ad,thisFile['name'],body[0],body[1:],self.consultations);
+    parses = thisFile['parses'].setdefault(ixBody,list());
+    for parse in parses:
+      if all(IsConsultationUnchanged(self.ad,consultation) for consultation in parse[0]):
+        if self.consultations != None:
+          self.consultations.extend(parse[0]);
+        return parse[1];
+    consulted = list();
+    rawTokens = RawTokens(self.ad,thisFile['name'],body[0],body[1:],consulted);
+    parses.insert(0,(consulted,rawTokens,));
+    del parses[self.maxParses:];
+    thisFile['changed'] = True;
+    if self.consultations != None:
+      self.consultations.extend(consulted);
+    return rawTokens;
+
+  def SaveCache(self):
+    """
+    Save the bodies and raw tokens of the files that were changed or not already
+    in the cache.\n
+    Note:  This must be called before the raw tokens are modified by the
+           subsequent stages of the assembler.
+    """
+    for thisFile in self.cachedFiles:
+      if thisFile['changed']:
+        try:
+          ssbccCache.WriteObject(self.cacheDir,thisFile['objectName'],dict(bodies=thisFile['bodies'], parses=thisFile['parses']));
+        except SSBCCException, msg:
+          raise AsmException(str(msg));
 
   def AddSearchPath(self,path):
     """
@@ -185,6 +492,168 @@ class FileBodyIterator:
   def Include(self,filename):
     self.pendingInclude = filename;
 
+################################################################################
+#
+# Split source lines into tokens.
+#
+################################################################################
+
+# Tokens recognized by LexLine.
+# Note:  The alternatives are tried in order at the start of each token, so
+#        comments, strings, and single-quoted characters take precedence over
+#        the white-space delimited tokens.  Strings and characters that don't
+#        match the allowed syntax are returned as the "badstring" and "badchar"
+#        tokens so that the error is only reported if the enclosing body is
+#        assembled.
+lexPattern = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<comment>;.*)
+  | (?P<string>N""|[CNc]?"(?:[^\\"]|\\.)+")
+  | (?P<badstring>[CNc]?")
+  | (?P<char>'(?:.|\\.|\\[xX][0-9A-Fa-f]{1,2}|\\[0-7]{1,3})')
+  | (?P<badchar>')
+  | (?P<word>\S+)
+''', re.VERBOSE);
+
+# Directives that occupy a single line and are processed by the top-level
+# assembler rather than by RawTokens.
+singleLineDirectivePattern = re.compile(r'\.(IFDEF|IFNDEF|ELSE|ENDIF|include)\b');
+
+def LexLine(line):
+  """
+  Split the line into its tokens in a single pass.\n
+  The return is a list of (col,kind,text) tuples where col is the zero-based
+  column of the start of the token, kind is one of "comment", "string",
+  "badstring", "char", "badchar", or "word", and text is the text of the token.
+  White space is not included in the list.
+  """
+  return [(a.start(),a.lastgroup,a.group(),) for a in lexPattern.finditer(line) if a.lastgroup != 'space'];
+
+def IsIncludeLine(tokens):
+  """
+  Indicate whether or not the tokens from LexLine start with the ".include"
+  directive.
+  """
+  return tokens and tokens[0][1] == 'word' and re.match(r'\.include\b',tokens[0][2]);
+
+def FileBodies(ad,lines):
+  """
+  Split the lines of a file into the bodies emitted by FileBodyIterator.\n
+  Each body is a list whose first element is the line number of the first line
+  of the body and whose subsequent elements are the (line,tokens) tuples for
+  the lines of the body.\n
+  Note:  The bodies only depend on the content of the file.
+  """
+  bodies = list();
+  current = list();
+  pending = list();
+  lineNumber = 0;
+  for line in lines:
+    lineNumber += 1;
+    tokens = LexLine(line);
+    line = (line,tokens,);
+    # Handle single-line directives.
+    # Note:  If there is a preceding body, then the lines following a
+    #        single-line directive other than ".include" are part of its body.
+    if tokens and tokens[0][1] == 'word' and singleLineDirectivePattern.match(tokens[0][2]):
+      if not pending:
+        pending.append(lineNumber);
+      pending.append(line);
+      if not current:
+        bodies.append(pending);
+      else:
+        bodies.append(current);
+        current = pending;
+        if IsIncludeLine(tokens):
+          bodies.append(current);
+          current = list();
+      pending = list();
+      continue;
+    # Append empty and comment lines to the pending block.
+    if not tokens or tokens[0][1] == 'comment':
+      if not pending:
+        pending.append(lineNumber);
+      pending.append(line);
+      continue;
+    # See if the line starts with a directive.
+    if tokens[0][1] == 'word' and ad.IsDirective(tokens[0][2]):
+      if not pending:
+        pending.append(lineNumber);
+      pending.append(line);
+      if current:
+        bodies.append(current);
+      current = pending;
+      pending = list();
+      continue;
+    # Otherwise, this line belongs to the body of the preceding directive.
+    if not pending:
+      pending.append(lineNumber);
+    if not current:
+      current.append(pending[0]);
+    current += pending[1:];
+    current.append(line);
+    pending = list();
+  # Emit the last body and any following comment lines.
+  if current:
+    bodies.append(current);
+  if pending:
+    bodies.append(pending);
+  return bodies;
+
+################################################################################
+#
+# Cache the bodies and raw tokens of the source files.
+#
+################################################################################
+
+# Hash of the assembler sources (see ParseCacheVersion).
+parseCacheVersion = None;
+
+def ParseCacheVersion():
+  """
+  Return the hash of the assembler sources that determine the bodies and raw
+  tokens saved in the cache.
+  """
+  global parseCacheVersion;
+  if not parseCacheVersion:
+    coreDir = os.path.dirname(os.path.abspath(__file__));
+    utilDir = os.path.dirname(os.path.abspath(ssbccCache.__file__));
+    h = hashlib.sha1();
+    for filename in (os.path.join(coreDir,'asmDef.py'),os.path.join(coreDir,'asmDef_9x8.py'),os.path.join(utilDir,'ssbccUtil.py'),):
+      try:
+        fp = open(filename,'rb');
+        h.update(fp.read());
+        fp.close();
+      except IOError:
+        raise AsmException('Error reading "%s"' % filename);
+    parseCacheVersion = h.hexdigest();
+  return parseCacheVersion;
+
+def IsConsultationUnchanged(ad,consultation):
+  """
+  Indicate whether or not a symbol, value, or macro consulted by RawTokens is
+  unchanged.  The consultations are recorded as the following tuples:
+    ('constant',name,body)      body of the constant or None if there is no
+                                such constant
+    ('expr',expression,value)   value of the "${...}" expression
+    ('macro',name,signature)    signature of the macro (see MacroSignature)
+    ('symbol',name,isSymbol)    whether or not the symbol is defined
+  """
+  (kind,name,value,) = consultation;
+  if kind == 'constant':
+    return (ad.symbols[name].body if ad.IsConstant(name) else None) == value;
+  elif kind == 'expr':
+    try:
+      return EvalExpr(name,ad.SymbolDict()) == value;
+    except SSBCCException:
+      return False;
+  elif kind == 'macro':
+    return ad.MacroSignature(name) == value;
+  elif kind == 'symbol':
+    return ad.IsSymbol(name) == value;
+  else:
+    raise Exception('Program Bug -- unrecognized consultation "%s"' % kind);
+
 ################################################################################
 #
 # Parse strings into the desired types.
@@ -287,7 +756,26 @@ def ParseString(inString):
   # That's all.
   return outString;
 
-def ParseToken(ad,fl_loc,col,raw,allowed):
+# Kinds of tokens recognized by ParseToken.
+# Note:  The alternatives are listed in the order in which ParseToken tests for
+#        them.
+tokenPattern = re.compile(r'''
+    (?P<computed>\$\{\S+\}$)
+  | (?P<repeated>(?P<repeatValue>0|0b[01_]+|0[0-7]+|[+\-]?[1-9]\d*|0x[0-9A-Fa-f]{1,2})\*(?P<repeatCount>[1-9]\d*|C_\w+|\$\{\S+\})$)
+  | (?P<number>(?:0|0b[01_]+|0[0-7]+|[+\-]?[1-9]\d*|0x[0-9A-Fa-f]+)$)
+  | (?P<string>[CNc]?")
+  | (?P<char>')
+  | (?P<macro>\.[A-Za-z])
+  | (?P<label>:[A-Za-z]\w*$)
+  | (?P<range>[LG]_\w+[[]\d+\+?:\d+]$)
+  | (?P<symbol>[A-Za-z]\w*$)
+''', re.VERBOSE);
+
+# Name of a macro and the individual arguments of a macro invocation.
+macroNamePattern = re.compile(r'\.[^(]+');
+macroArgPattern = re.compile(r'[^,(]*(\([^)]*\))?');
+
+def ParseToken(ad,fl_loc,col,raw,allowed,consulted=None):
   """
   Examine the raw tokens and convert them into dictionary objects consisting of
   the following:
@@ -300,6 +788,9 @@ def ParseToken(ad,fl_loc,col,raw,allowed):
     argument    optional entry required for macros arguments
     range       optional entry required when a range is provided for a parameter\n
   The token type is compared against the allowed tokens.\n
+  If provided, the constants, expression values, and macros consulted to parse
+  the token are appended to the list "consulted" (see
+  IsConsultationUnchanged).\n
   Detect syntax errors and display error messages consisting of the error and
   the location within the file where the error occurs.
   """
@@ -311,28 +802,26 @@ def ParseToken(ad,fl_loc,col,raw,allowed):
     if 'instruction' not in allowed:
       raise AsmException('instruction "%s" not allowed at %s' % (raw,flc_loc));
     return dict(type='instruction', value=raw, loc=flc_loc);
+  a = tokenPattern.match(raw);
+  kind = a.lastgroup if a else None;
   # look for computation
-  a = re.match(r'\${\S+}$',raw);
-  if a:
+  if kind == 'computed':
     if 'singlevalue' not in allowed:
       raise AsmException('Computed value not allowed at %s' % flc_loc);
     try:
-      tParseNumber = eval(raw[2:-1],ad.SymbolDict());
-    except:
+      tParseNumber = EvalExpr(raw[2:-1],ad.SymbolDict());
+    except SSBCCException:
       raise AsmException('Malformed computed value at %s: "%s"' % (flc_loc,raw,));
     if type(tParseNumber) != int:
       raise AsmException('Malformed single-byte value at %s' % flc_loc);
+    if consulted != None:
+      consulted.append(('expr',raw[2:-1],tParseNumber,));
     return dict(type='value', value=tParseNumber, loc=flc_loc);
   # look for a repeated single-byte numeric value (N*M where M is the repeat count)
-  matchString=r'(0|0b[01_]+|0[0-7]+|[+\-]?[1-9]\d*|0x[0-9A-Fa-f]{1,2})\*([1-9]\d*|C_\w+|\$\{\S+\})$';
-  a = re.match(matchString,raw);
-  if a:
+  if kind == 'repeated':
     if 'multivalue' not in allowed:
       raise AsmException('Multi-byte value not allowed at %s' % flc_loc);
-    b = re.findall(matchString,a.group(0));
-    if not b:
-      raise Exception('Program Bug -- findall failed after match worked');
-    b = b[0];
+    b = (a.group('repeatValue'),a.group('repeatCount'),);
     try:
       tParseNumber = ParseNumber(b[0]);
     except:
@@ -344,12 +833,19 @@ def ParseToken(ad,fl_loc,col,raw,allowed):
     elif re.match(r'C_',b[1]):
       if not ad.IsConstant(b[1]):
         raise AsmException('Unrecognized symbol "%s" at %s' % (b[1],fl_loc2,));
-      ix = ad.symbols['list'].index(b[1]);
-      if len(ad.symbols['body'][ix]) != 1:
+      body = ad.symbols[b[1]].body;
+      if len(body) != 1:
         raise asmDef.AsmException('constant can only be one byte at %s' % fl_loc2);
-      repeatCount = ad.symbols['body'][ix][0];
+      repeatCount = body[0];
+      if consulted != None:
+        consulted.append(('constant',b[1],body,));
     elif re.match(r'\$',b[1]):
-      repeatCount = eval(b[1][2:-1],ad.SymbolDict());
+      try:
+        repeatCount = EvalExpr(b[1][2:-1],ad.SymbolDict());
+      except SSBCCException:
+        raise AsmException('Malformed computed value at %s: "%s"' % (fl_loc2,b[1],));
+      if consulted != None:
+        consulted.append(('expr',b[1][2:-1],repeatCount,));
     else:
       raise Exception('Program Bug -- unrecognized repeat count');
     if repeatCount <= 0:
@@ -358,8 +854,7 @@ def ParseToken(ad,fl_loc,col,raw,allowed):
       tValue.append(tParseNumber);
     return dict(type='value', value=tValue, loc=flc_loc);
   # look for a single-byte numeric value
-  a = re.match(r'(0|0b[01_]+|0[0-7]+|[+\-]?[1-9]\d*|0x[0-9A-Fa-f]+)$',raw);
-  if a:
+  if kind == 'number':
     if 'singlevalue' not in allowed:
       raise AsmException('Value not allowed at %s' % flc_loc);
     try:
@@ -368,7 +863,7 @@ def ParseToken(ad,fl_loc,col,raw,allowed):
       raise AsmException('Malformed single-byte value at %s' % flc_loc);
     return dict(type='value', value=tParseNumber, loc=flc_loc);
   # capture double-quoted strings
-  if re.match(r'[CNc]?"',raw):
+  if kind == 'string':
     if 'string' not in allowed:
       raise AsmException('String not allowed at %s' % flc_loc);
     parsedString = ParseString(raw);
@@ -376,7 +871,7 @@ def ParseToken(ad,fl_loc,col,raw,allowed):
       raise AsmException('Malformed string at %s' % (fl_loc + ':' + str(col+parsedString)));
     return dict(type='value', value=parsedString, loc=flc_loc);
   # capture single-quoted character
-  if raw[0] == "'":
+  if kind == 'char':
     if 'singlevalue' not in allowed:
       raise AsmException('Character not allowed at %s' % flc_loc);
     (thisChar,thisLen,) = ParseChar(raw[1:-1]);
@@ -390,11 +885,12 @@ def ParseToken(ad,fl_loc,col,raw,allowed):
     return dict(type='directive', value=raw, loc=flc_loc);
   # look for macros
   # Note:  Macro arguments can contain a single layer of macros.
-  a = re.match(r'\.[A-Za-z]',raw);
-  if a:
-    b = re.match(r'\.[^(]+',raw);
+  if kind == 'macro':
+    b = macroNamePattern.match(raw);
     if not ad.IsMacro(b.group(0)):
       raise AsmException('Unrecognized directive or macro at %s:%d' % (fl_loc,col+1,));
+    if consulted != None:
+      consulted.append(('macro',b.group(0),ad.MacroSignature(b.group(0)),));
     if ('macro' not in allowed) and not ('singlemacro' in allowed and ad.IsSingleMacro(b.group(0))):
       raise AsmException('Macro "%s" not allowed at %s:%d' % (b.group(0),fl_loc,col+1,));
     macroArgs = list();
@@ -405,7 +901,7 @@ def ParseToken(ad,fl_loc,col,raw,allowed):
     else:
       tcol = len(b.group(0))+1;
       while tcol < len(raw):
-        c = re.match(r'[^,(]*(\([^)]*\))?',raw[tcol:-1]);
+        c = macroArgPattern.match(raw,tcol,len(raw)-1);
         macroArgs.append(c.group(0));
         tcol += len(c.group(0))+1;
     nArgs = ad.MacroNumberArgs(b.group(0))
@@ -416,18 +912,16 @@ def ParseToken(ad,fl_loc,col,raw,allowed):
     outArgs = list();
     tcol = col + len(b.group(0)) + 1;
     for ixArg in range(len(macroArgs)):
-      outArgs.append(ParseToken(ad,fl_loc,tcol,macroArgs[ixArg],ad.MacroArgTypes(b.group(0),ixArg)));
+      outArgs.append(ParseToken(ad,fl_loc,tcol,macroArgs[ixArg],ad.MacroArgTypes(b.group(0),ixArg),consulted));
       tcol += len(macroArgs[ixArg]) + 1;
     return dict(type='macro', value=b.group(0), loc=fl_loc + ':' + str(col+1), argument=outArgs);
   # look for a label definition
-  a = re.match(r':[A-Za-z]\w*$',raw);
-  if a:
+  if kind == 'label':
     if 'label' not in allowed:
       raise AsmException('Label not allowed at %s' % flc_loc);
     return dict(type='label', value=raw[1:], loc=flc_loc);
   # look for parameters with range specification
-  a = re.match('[LG]_\w+[[]\d+\+?:\d+]$',raw);
-  if a:
+  if kind == 'range':
     if 'symbol' not in allowed:
       raise AsmException('Symbol not allowed at %s' % flc_loc);
     a = re.findall('([LG]_\w+)([[].*)',raw)[0];
@@ -435,11 +929,10 @@ def ParseToken(ad,fl_loc,col,raw,allowed):
   # look for symbols
   # Note:  This should be the last check performed as every other kind of
   #        token should be recognizable
-  a = re.match(r'[A-Za-z]\w*$',raw);
-  if a:
+  if kind == 'symbol':
     if 'symbol' not in allowed:
       raise AsmException('Symbol not allowed at %s' % flc_loc);
-    return dict(type='symbol', value=a.group(0), loc=flc_loc);
+    return dict(type='symbol', value=raw, loc=flc_loc);
   # anything else is an error
   raise AsmException('Malformed entry at %s:  "%s"' % (flc_loc,raw,));
 
@@ -451,13 +944,17 @@ def ParseToken(ad,fl_loc,col,raw,allowed):
 #
 ################################################################################
 
-def RawTokens(ad,filename,startLineNumber,lines):
+def RawTokens(ad,filename,startLineNumber,lines,consulted=None):
   """
-  Extract the list of tokens from the provided list of lines.
+  Extract the list of tokens from the provided list of (line,tokens) tuples
+  generated by FileBodyIterator.
   Convert the directive body into a list of individual tokens.\n
   Tokens are directive names, symbol names, values, strings, labels, etc.\n
   The return is a list of the tokens in the sequence they are encountered.  Each
-  of these tokens is a dictionary object constructed by ParseToken.
+  of these tokens is a dictionary object constructed by ParseToken.\n
+  If provided, the symbols, expression values, and macros consulted to generate
+  the tokens are appended to the list "consulted" (see
+  IsConsultationUnchanged).
   """
   allowed = [
               'instruction',
@@ -471,72 +968,53 @@ def RawTokens(ad,filename,startLineNumber,lines):
   ifstack = list();
   tokens = list();
   lineNumber = startLineNumber - 1;
-  for line in lines:
+  for (line,lineTokens) in lines:
     lineNumber = lineNumber + 1;
     fl_loc = '%s:%d' % (filename,lineNumber);
-    col = 0;
-    spaceFound = True;
-    while col < len(line):
+    endCol = None;
+    for (col,kind,candToken) in lineTokens:
       flc_loc = fl_loc + ':' + str(col+1);
-      # Identify and then ignore white-space characters.
-      if re.match(r'\s',line[col:]):
-        spaceFound = True;
-        col = col + 1;
-        continue;
       # Ensure tokens start on new lines or are separated by spaces.
-      if not spaceFound:
+      if col == endCol:
         raise AsmException('Missing space in %s:%d' % (fl_loc,col+1));
-      spaceFound = False;
+      endCol = col + len(candToken);
       # Ignore comments.
-      if line[col] == ';':
+      if kind == 'comment':
         break;
-      # Catch N"" string.
-      if re.match(r'N""',line[col:]):
-        a = re.match(r'N""',line[col:]);
-      # Catch strings.
-      elif re.match(r'[CNc]?"',line[col:]):
-        a = re.match(r'[CNc]?"([^\\"]|\\.)+"',line[col:]);
-        if not a:
-          raise AsmException('Malformed string at %s' % flc_loc);
-      # Catch single-quoted characters
-      elif re.match(r'\'',line[col:]):
-        a = re.match(r'\'(.|\\.|\\[xX][0-9A-Fa-f]{1,2}|\\[0-7]{1,3})\'',line[col:]);
-        if not a:
-          raise AsmException('Malformed \'.\' at %s' % flc_loc);
-      else:
-        # Everything else is a white-space delimited token.
-        a = re.match(r'\S+',line[col:]);
-      # Get the candidate token.
-      candToken = a.group(0);
+      # Catch malformed strings and single-quoted characters.
+      if kind == 'badstring':
+        raise AsmException('Malformed string at %s' % flc_loc);
+      if kind == 'badchar':
+        raise AsmException('Malformed \'.\' at %s' % flc_loc);
       # Catch conditional code inclusion constructs before parsing the token
-      if candToken == '.else':
-        if not ifstack:
-          raise AsmException('Unmatched ".else" at %s' % flc_loc);
-        ifstack[-1] = not ifstack[-1];
-        col += 5;
-        continue;
-      if candToken == '.endif':
-        if not ifstack:
-          raise AsmException('Unmatched ".endif" at %s' % flc_loc);
-        ifstack.pop();
-        col += 6;
-        continue;
-      elif re.match(r'\.ifdef\(',candToken):
-        a = re.findall(r'\.ifdef\((\w+)\)$',candToken);
-        if not a:
-          raise AsmException('Malformed ".ifdef" at %s' % flc_loc);
-        ifstack.append(ad.IsSymbol(a[0]));
-        col += 8+len(a[0]);
-        continue;
-      elif re.match(r'\.ifndef\(',candToken):
-        a = re.findall(r'\.ifndef\((\w+)\)$',candToken);
-        if not a:
-          raise AsmException('Malformed ".ifndef" at %s' % flc_loc);
-        ifstack.append(not ad.IsSymbol(a[0]));
-        col += 9+len(a[0]);
-        continue;
+      if kind == 'word' and candToken[0] == '.':
+        if candToken == '.else':
+          if not ifstack:
+            raise AsmException('Unmatched ".else" at %s' % flc_loc);
+          ifstack[-1] = not ifstack[-1];
+          continue;
+        if candToken == '.endif':
+          if not ifstack:
+            raise AsmException('Unmatched ".endif" at %s' % flc_loc);
+          ifstack.pop();
+          continue;
+        elif candToken.startswith('.ifdef('):
+          a = re.findall(r'\.ifdef\((\w+)\)$',candToken);
+          if not a:
+            raise AsmException('Malformed ".ifdef" at %s' % flc_loc);
+          ifstack.append(ad.IsSymbol(a[0]));
+          if consulted != None:
+            consulted.append(('symbol',a[0],ifstack[-1],));
+          continue;
+        elif candToken.startswith('.ifndef('):
+          a = re.findall(r'\.ifndef\((\w+)\)$',candToken);
+          if not a:
+            raise AsmException('Malformed ".ifndef" at %s' % flc_loc);
+          ifstack.append(not ad.IsSymbol(a[0]));
+          if consulted != None:
+            consulted.append(('symbol',a[0],not ifstack[-1],));
+          continue;
       if ifstack and not ifstack[-1]:
-        col += len(candToken);
         continue;
       # Determine which kinds of tokens are allowed at this location in the
       # directive body.
@@ -545,8 +1023,7 @@ def RawTokens(ad,filename,startLineNumber,lines):
       else:
         selAllowed = allowed;
       # Append the parsed token to the list of tokens.
-      tokens.append(ParseToken(ad,fl_loc,col,candToken,selAllowed));
-      col += len(candToken);
+      tokens.append(ParseToken(ad,fl_loc,col,candToken,selAllowed,consulted));
   if ifstack:
     raise AsmException('%d unmatched conditionals at line %d' % (len(ifstack),lineNumber,));
   return tokens;
@@ -14,6 +14,7 @@ import sys
 import types
 
 import asmDef
+import asmOptimize
 
 class asmDef_9x8:
   """
@@ -38,52 +39,50 @@ class asmDef_9x8:
   #
   ################################################################################
 
-  def AddSymbol(self,name,stype,body=None):
+  def AddSymbol(self,name,stype,body=None,loc=None):
     """
     Add the named global symbol to the list of symbols including its mandatory
-    type and an optional body.\n
+    type, an optional body, and the optional location of its definition.\n
     Note:  Symbols include memory names, variables, constants, defines,
            functions, parameters, inports, outports, ...
     """
     if self.IsSymbol(name):
       raise Exception('Program Bug -- name "%s" already exists is symbols' % name);
-    self.symbols['list'].append(name);
-    self.symbols['type'].append(stype);
-    self.symbols['body'].append(body);
+    self.symbols.Add(name,stype,body,loc);
+    # Add constants and variable locations and variable lengths to the
+    # namespace for "${...}" expressions.
+    if stype == 'constant':
+      if name != 'size':
+        self.symbolNamespace[name] = body[0];
+    elif stype == 'variable':
+      if name != 'size':
+        self.symbolNamespace[name] = body['start'];
+      self.AddSymbolSize(name,len(body['value']));
+
+  def AddSymbolSize(self,name,value):
+    """
+    Add the length of the named memory, variable, or stack to the "size"
+    dictionary of the namespace for "${...}" expressions.\n
+    Note:  Duplicate names are reported when an expression is evaluated.
+    """
+    if name in self.symbolNamespace['size']:
+      self.symbolSizeConflicts.append(name);
+    self.symbolNamespace['size'][name] = value;
 
   def IsSymbol(self,name):
-    return name in self.symbols['list'];
+    return name in self.symbols;
 
   def SymbolDict(self):
     """
     Return a dict object usable by the eval function with the currently defines
     symbols for constants, variables, memory and I/O signal lengths, variable
-    lengths, and stack lengths.
-    """
-    t = dict();
-    # Add constants and variable locations.
-    for ixSymbol in range(len(self.symbols['list'])):
-      name = self.symbols['list'][ixSymbol];
-      stype = self.symbols['type'][ixSymbol];
-      if stype == 'constant':
-        t[name] = self.symbols['body'][ixSymbol][0];
-      elif stype == 'variable':
-        t[name] = self.symbols['body'][ixSymbol]['start'];
-    # Construct and add dictionary of sizes.
-    sizes=dict();
-    def AddSize(name,value):
-      if name in sizes:
-        raise Exception('Program Bug:  Symbol "%s" multiply defined');
-      sizes[name] = value;
-    for name in self.memoryLength:
-      AddSize(name,self.memoryLength[name]);
-    for ix in [ix for ix in range(len(self.symbols['type'])) if self.symbols['type'][ix] == 'variable']:
-      AddSize(self.symbols['list'][ix],len(self.symbols['body'][ix]['value']));
-    for name in self.stackLength:
-      AddSize(name,self.stackLength[name]);
-    t['size'] = sizes;
-    # That's all.
-    return t;
+    lengths, and stack lengths.\n
+    Note:  The dict is maintained by AddSymbol, RegisterMemoryLength, and
+           RegisterStackLength as the symbols are defined.
+    """
+    if self.symbolSizeConflicts:
+      raise Exception('Program Bug:  Symbol "%s" multiply defined');
+    return self.symbolNamespace;
 
   ################################################################################
   #
@@ -113,12 +112,8 @@ class asmDef_9x8:
 
     Also record the allowed number of allowed arguments to the macro.
     """
-    if name in self.macros['list']:
+    if name in self.macros:
       raise Exception('Program Bug -- name "%s" has already been listed as a macro' % name);
-    self.macros['list'].append(name);
-    self.macros['length'].append(macroLength);
-    self.macros['args'].append(args);
-    self.macros['doc'].append(doc)
     # Compute the range of the number of allowed arguments by first counting
     # the number of required arguments and then determining whether or not
     # there is at most one optional argument.
@@ -127,7 +122,8 @@ class asmDef_9x8:
       nRequired = nRequired + 1;
     if nRequired < len(args)-1:
       raise Exception('Program Bug -- Only the last macro argument can be optional');
-    self.macros['nArgs'].append(range(nRequired,len(args)+1));
+    self.lastMacro = asmDef.Macro(name,macroLength,args,range(nRequired,len(args)+1),doc);
+    self.macros[name] = self.lastMacro;
 
   def AddMacroSearchPath(self,path):
     self.macroSearchPaths.append(path);
@@ -149,61 +145,62 @@ class asmDef_9x8:
         break;
     else:
       raise asmDef.AsmException('Definition for macro "%s" not found' % macroName);
+    self.macroFiles.append(fullMacro);
     execfile(fullMacro);
     exec('%s(self)' % macroName);
     exec('docString = %s.__doc__' % macroName)
-    if docString and not self.macros['doc'][-1]:
-      self.macros['doc'][-1] = docString
+    if docString and not self.lastMacro.doc:
+      self.lastMacro.doc = docString
 
   def IsBuiltInMacro(self,name):
     """
     Indicate if the macro is built-in to the assembler or is taken from the
     ./macros directory.
     """
-    return name in self.macros['builtIn'];
+    return (name in self.macros) and self.macros[name].builtIn;
 
   def IsMacro(self,name):
     """
     Indicate whether or not the string "name" is a recognized macro.
     """
-    return name in self.macros['list'];
+    return name in self.macros;
 
   def IsSingleMacro(self,name):
     """
     Indicate whether or not the macro is only one instruction long.
     """
-    if name not in self.macros['list']:
+    if name not in self.macros:
       raise Exception('Program Bug -- name "%s" is not a macro' % name);
-    ix = self.macros['list'].index(name);
-    return (self.macros['length'][ix] == 1);
+    return (self.macros[name].length == 1);
 
   def MacroArgTypes(self,name,ixArg):
     """
     Return the list of allowed types for the macro name for argument ixArg.
     """
-    if name not in self.macros['list']:
+    if name not in self.macros:
       raise Exception('Program Bug -- name "%s" is not a macro' % name);
-    ix = self.macros['list'].index(name);
-    return self.macros['args'][ix][ixArg][1:];
+    return self.macros[name].args[ixArg][1:];
 
   def MacroDefault(self,name,ixArg):
     """
     Return the default argument for the macro name for argument ixArg.
     """
-    if name not in self.macros['list']:
+    if name not in self.macros:
       raise Exception('Program Bug -- name "%s" is not a macro' % name);
-    ix = self.macros['list'].index(name);
-    return self.macros['args'][ix][ixArg][0];
+    return self.macros[name].args[ixArg][0];
 
   def MacroLength(self,token):
     """
     Return the length of fixed-length macros or compute and return the length
-    of variable-length macros.
+    of variable-length macros.\n
+    Note:  The length of a variable-length macro is recorded in the expanded
+           token by ExpandTokens so that it is only computed once.
     """
-    if token['value'] not in self.macros['list']:
+    if 'length' in token:
+      return token['length'];
+    if token['value'] not in self.macros:
       raise Exception('Program Bug -- name "%s" is not a macro' % token['value']);
-    ix = self.macros['list'].index(token['value']);
-    length = self.macros['length'][ix];
+    length = self.macros[token['value']].length;
     if type(length) == int:
       return length;
     elif type(length) == types.FunctionType:
@@ -211,14 +208,22 @@ class asmDef_9x8:
     else:
       raise Exception('Program Bug -- Unrecognized variable length macro "%s"' % token['value']);
 
+  def MacroSignature(self,name):
+    """
+    Return the properties of the named macro used to parse its invocations or
+    None if it is not a macro.
+    """
+    if name not in self.macros:
+      return None;
+    return (self.macros[name].length == 1,self.macros[name].args,);
+
   def MacroNumberArgs(self,name):
     """
     Return the range of the number of allowed arguments to the named macro.
     """
-    if name not in self.macros['list']:
+    if name not in self.macros:
       raise Exception('Program bug -- name "%s" is not a macro' % name);
-    ix = self.macros['list'].index(name);
-    return self.macros['nArgs'][ix];
+    return self.macros[name].nArgs;
 
   ################################################################################
   #
@@ -260,8 +265,7 @@ class asmDef_9x8:
     """
     if not self.IsSymbol(name):
       return False;
-    ix = self.symbols['list'].index(name);
-    return self.symbols['type'][ix] == 'constant';
+    return self.symbols[name].type == 'constant';
 
   def IsInport(self,name):
     """
@@ -269,8 +273,7 @@ class asmDef_9x8:
     """
     if not self.IsSymbol(name):
       return False;
-    ix = self.symbols['list'].index(name);
-    return self.symbols['type'][ix] == 'inport';
+    return self.symbols[name].type == 'inport';
 
   def IsOutport(self,name):
     """
@@ -278,8 +281,7 @@ class asmDef_9x8:
     """
     if not self.IsSymbol(name):
       return False;
-    ix = self.symbols['list'].index(name);
-    return self.symbols['type'][ix] == 'outport';
+    return self.symbols[name].type == 'outport';
 
   def IsOutstrobe(self,name):
     """
@@ -287,8 +289,7 @@ class asmDef_9x8:
     """
     if not self.IsSymbol(name):
       return False;
-    ix = self.symbols['list'].index(name);
-    return self.symbols['type'][ix] == 'outstrobe';
+    return self.symbols[name].type == 'outstrobe';
 
   def IsParameter(self,name):
     """
@@ -296,8 +297,7 @@ class asmDef_9x8:
     """
     if not self.IsSymbol(name):
       return False;
-    ix = self.symbols['list'].index(name);
-    return self.symbols['type'][ix] == 'parameter';
+    return self.symbols[name].type == 'parameter';
 
   def InportAddress(self,name):
     """
@@ -305,8 +305,7 @@ class asmDef_9x8:
     """
     if not self.IsInport(name):
       raise Exception('Program Bug -- "%s" is not an inport' % name);
-    ix = self.symbols['list'].index(name);
-    return self.symbols['body'][ix];
+    return self.symbols[name].body;
 
   def OutportAddress(self,name):
     """
@@ -314,8 +313,7 @@ class asmDef_9x8:
     """
     if not self.IsOutport(name) and not self.IsOutstrobe(name):
       raise Exception('Program Bug -- "%s" is not an outport' % name);
-    ix = self.symbols['list'].index(name);
-    return self.symbols['body'][ix];
+    return self.symbols[name].body;
 
   def RegisterInport(self,name,address):
     """
@@ -358,6 +356,10 @@ class asmDef_9x8:
     Record the length of the specified memory.\n
     Note:  This is used to evaluate "size[name]" in "${...}" expressions.
     """
+    if name in self.memoryLength:
+      self.symbolNamespace['size'][name] = length;
+    else:
+      self.AddSymbolSize(name,length);
     self.memoryLength[name] = length;
 
   def RegisterStackLength(self,name,length):
@@ -367,6 +369,10 @@ class asmDef_9x8:
     Note:  This differs from RegisterMemoryLength() in that the stack lengths
            can be larger than 256.
     """
+    if name in self.stackLength:
+      self.symbolNamespace['size'][name] = length;
+    else:
+      self.AddSymbolSize(name,length);
     self.stackLength[name] = length;
 
   ################################################################################
@@ -382,8 +388,7 @@ class asmDef_9x8:
     """
     if not self.IsSymbol(name):
       raise asmDef.AsmException('Undefined symbol "%s" at %s' % (name,loc));
-    ixName = self.symbols['list'].index(name);
-    if self.symbols['type'][ixName] not in allowableTypes:
+    if self.symbols[name].type not in allowableTypes:
       raise asmDef.AsmException('Illegal symbol at %s' % loc);
 
   def CheckRawTokens(self,rawTokens):
@@ -412,21 +417,21 @@ class asmDef_9x8:
         if token['type'] == 'instruction':
           raise asmDef.AsmException('Instruction not allowed in directive at %s' % token['loc']);
     # Ensure local labels are defined and used.
-    labelDefs = list();
+    labelDefs = set();
     for token in rawTokens:
       if token['type'] == 'label':
         name = token['value'];
         if name in labelDefs:
           raise asmDef.AsmException('Repeated label definition "%s" at %s' % (name,token['loc'],));
-        labelDefs.append(name);
-    labelsUsed = list();
+        labelDefs.add(name);
+    labelsUsed = set();
     for token in rawTokens:
       if (token['type'] == 'macro') and (token['value'] in ('.jump','.jumpc',)):
         target = token['argument'][0]['value'];
         if target not in labelDefs:
           raise asmDef.AsmException('label definition for target missing at %s' % token['loc']);
-        labelsUsed.append(target);
-    labelsUnused = set(labelDefs) - set(labelsUsed);
+        labelsUsed.add(target);
+    labelsUnused = labelDefs - labelsUsed;
     if labelsUnused:
       raise asmDef.AsmException('Unused label(s) %s in body %s' % (labelsUnused,firstToken['loc']));
     # Ensure referenced symbols are already defined (other than labels and
@@ -487,11 +492,10 @@ class asmDef_9x8:
     values = list();
     for token in rawTokens:
       if token['type'] == 'symbol':
-        ix = self.symbols['list'].index(token['value']);
-        symbolType = self.symbols['type'][ix];
-        if symbolType != 'constant':
+        symbol = self.symbols[token['value']];
+        if symbol.type != 'constant':
           raise asmDef.AsmException('Illegal symbol "%s" at %s' % (token['value'],token['loc'],));
-        value = self.symbols['body'][ix];
+        value = symbol.body;
       elif token['type'] == 'value':
         value = token['value'];
       else:
@@ -521,15 +525,15 @@ class asmDef_9x8:
     """
     if not self.IsSymbol(token['value']):
       raise asmDef.AsmException('Symbol "%s" not in symbol list at %s' %(token['value'],token['loc'],));
-    ix = self.symbols['list'].index(token['value']);
-    symbolType = self.symbols['type'][ix];
+    symbol = self.symbols[token['value']];
+    symbolType = symbol.type;
     if symbolType == 'RAM':
       return dict(type='RAM', value=token['value'], loc=token['loc']);
     elif symbolType == 'ROM':
       return dict(type='ROM', value=token['value'], loc=token['loc']);
     elif symbolType == 'constant':
       if singleValue:
-        thisBody = self.symbols['body'][ix];
+        thisBody = symbol.body;
         if len(thisBody) != 1:
           raise asmDef.AsmException('Constant "%s" must evaluate to a single byte at %s' % (token['value'],token['loc'],))
         thisBody = thisBody[0];
@@ -584,8 +588,9 @@ class asmDef_9x8:
             offset = offset + 1;
       # append macros
       elif token['type'] == 'macro':
-        tokens.append(dict(type=token['type'], value=token['value'], offset=offset, argument=token['argument'], loc=token['loc']));
-        offset = offset + self.MacroLength(token);
+        length = self.MacroLength(token);
+        tokens.append(dict(type=token['type'], value=token['value'], offset=offset, argument=token['argument'], loc=token['loc'], length=length));
+        offset = offset + length;
       # interpret and append symbols
       elif token['type'] == 'symbol':
         newToken = self.ExpandSymbol(token,singleValue=False);
@@ -593,8 +598,7 @@ class asmDef_9x8:
         newToken['loc'] = token['loc'];
         tokens.append(newToken);
         if token['type'] == 'constant':
-          ix = self.symbols['list'].index(newToken['value']);
-          offset = offset + len(self.symbols['body'][ix]);
+          offset = offset + len(self.symbols[newToken['value']].body);
         else:
           offset = offset + 1;
       # anything else is a program bug
@@ -627,13 +631,13 @@ class asmDef_9x8:
     # Perform syntax-specific processing.
     if firstToken['value'] == '.constant':
       byteList = self.ByteList(rawTokens[2:]);
-      self.AddSymbol(secondToken['value'],'constant',body=byteList);
+      self.AddSymbol(secondToken['value'],'constant',body=byteList,loc=secondToken['loc']);
     # Process ".define" directive
     elif firstToken['value'] == '.define':
-      self.AddSymbol(secondToken['value'],'define');
+      self.AddSymbol(secondToken['value'],'define',loc=secondToken['loc']);
     # Process ".function" definition.
     elif firstToken['value'] == '.function':
-      self.AddSymbol(secondToken['value'],'function',self.ExpandTokens(rawTokens[2:]));
+      self.AddSymbol(secondToken['value'],'function',self.ExpandTokens(rawTokens[2:]),loc=secondToken['loc']);
     # Process ".interrupt" definition.
     elif firstToken['value'] == '.interrupt':
       if self.interrupt:
@@ -649,7 +653,7 @@ class asmDef_9x8:
         raise asmDef.AsmException('Macro "%s" is an instruction at %s' % (fullMacroName,secondToken['loc'],));
       if self.IsBuiltInMacro(fullMacroName):
         raise asmDef.AsmException('Macro "%s" is a built-in macro at %s' % (fullMacroName,secondToken['loc'],));
-      if fullMacroName not in self.macros['list']:
+      if fullMacroName not in self.macros:
         self.AddUserMacro(macroName);
     # Process ".main" definition.
     elif firstToken['value'] == '.main':
@@ -666,21 +670,19 @@ class asmDef_9x8:
       if thirdToken['type'] != 'symbol':
         raise asmDef.AsmException('".memory" directive requires name for second argument at %s' % thirdToken['loc']);
       if self.IsSymbol(thirdToken['value']):
-        ix = self.symbols['list'].index(thirdToken['value']);
-        if self.symbols['type'] != secondToken['value']:
+        if self.symbols[thirdToken['value']].type != secondToken['value']:
           raise asmDef.AsmException('Redefinition of ".memory %s %s" not allowed at %s' % (secondToken['value'],thirdToken['value'],firstToken['loc']));
       else:
-        self.AddSymbol(thirdToken['value'],secondToken['value'],dict(length=0));
+        self.AddSymbol(thirdToken['value'],secondToken['value'],dict(length=0),loc=thirdToken['loc']);
       self.currentMemory = thirdToken['value'];
     # Process ".variable" declaration.
     elif firstToken['value'] == '.variable':
       if not self.currentMemory:
         raise asmDef.AsmException('".memory" directive required before ".variable" directive at %s' % firstToken['line']);
-      ixMem = self.symbols['list'].index(self.currentMemory);
-      currentMemoryBody = self.symbols['body'][ixMem];
+      currentMemoryBody = self.symbols[self.currentMemory].body;
       byteList = self.ByteList(rawTokens[2:],limit=True);
       body = dict(memory=self.currentMemory, start=currentMemoryBody['length'], value=byteList);
-      self.AddSymbol(secondToken['value'], 'variable', body=body);
+      self.AddSymbol(secondToken['value'], 'variable', body=body, loc=secondToken['loc']);
       currentMemoryBody['length'] = currentMemoryBody['length'] + len(byteList);
       if currentMemoryBody['length'] > 256:
         raise asmDef.AsmException('Memory "%s" becomes too long at %s' % (self.currentMemory,firstToken['loc']));
@@ -720,15 +722,15 @@ class asmDef_9x8:
     self.memories = dict(list=list(), type=list(), length=list(), bank=list());
     ramBank = 0;
     romBank = 3;
-    for ix in range(len(self.symbols['list'])):
-      if self.symbols['type'][ix] in ('RAM','ROM',):
-        memBody = self.symbols['body'][ix];
+    for symbol in self.symbols.All():
+      if symbol.type in ('RAM','ROM',):
+        memBody = symbol.body;
         if memBody['length'] == 0:
-          raise asmDef.AsmException('Empty memory:  %s' % self.symbols['list'][ix]);
-        self.memories['list'].append(self.symbols['list'][ix]);
-        self.memories['type'].append(self.symbols['type'][ix]);
+          raise asmDef.AsmException('Empty memory:  %s' % symbol.name);
+        self.memories['list'].append(symbol.name);
+        self.memories['type'].append(symbol.type);
         self.memories['length'].append(memBody['length']);
-        if self.symbols['type'][ix] == 'RAM':
+        if symbol.type == 'RAM':
           self.memories['bank'].append(ramBank);
           ramBank = ramBank + 1;
         else:
@@ -739,85 +741,85 @@ class asmDef_9x8:
 
   ################################################################################
   #
-  # Generate the list of required functions from the ".main" and ".interrupt"
-  # bodies.
+  # Generate the call graph of the required functions from the ".main" and
+  # ".interrupt" bodies.
   #
-  # Look for function calls with the bodies of the required functions.  If the
-  # function has not already been identified as a required function then (1)
-  # ensure it exists and is a function and then (2) add it to the list of
-  # required functions.
+  # The call graph doubles as the work list:  the bodies of the required
+  # functions are scanned in the order in which the functions were added and
+  # each called function not already in the graph is (1) checked to exist and
+  # be a function and then (2) appended to the graph.  Tail calls, i.e., jumps
+  # to functions marked by the "tailcall" attribute of their tokens (see
+  # asmOptimize.TailCalls), are treated as calls.
   #
-  # Whenever a function is added to the list, set its start address and get its
-  # length.
+  # Whenever a function is added to the graph, set its start address, its
+  # length, and its call depth.
   #
   ################################################################################
 
-  def EvaluateFunctionTree(self):
-    """
-    Create a list of the functions required by the program, starting with the
-    required .main function and the optional .interrupt function.\n
-    Record the length of each function, its body, and its start address and
-    calculate the addresses of the labels within each function body.\n
+  def EvaluateFunctionTree(self,previous=None,limit=None,fallThrough=False):
+    """
+    Create the call graph of the functions required by the program, starting
+    with the required .main function and the optional .interrupt function.\n
+    Record the length of each function, its body, its start address, its
+    callers and callees, and its call depth and calculate the addresses of the
+    labels within each function body.\n
+    If the placement of the functions in a previous build is provided (see
+    asmDef.ReadPlacementMap), then keep the functions at their previous
+    addresses where possible without making the program longer than the
+    optional limit.  The reason for doing a full relayout instead is returned,
+    otherwise None is returned.\n
+    Otherwise, if fallThrough is True, then the functions ending with a tail
+    call are placed to fall through into the called functions where possible
+    (see asmOptimize.FallThrough).\n
     Finally, ensure the function address space does not exceed the absolute
     8192 address limit.
     """
-    self.functionEvaluation = dict(list=list(), length=list(), body=list(), address=list());
-    nextStart = 0;
     # ".interrupt" is optionally required (and is sure to exist by this
     # function call if it is required).  The interrupt handler always starts at
     # address 3 so that address 0 can be a jump to ".main".
+    self.callGraph = asmDef.CallGraph(3 if self.interrupt else 0);
     if self.interrupt:
-      nextStart = 3;
-      self.functionEvaluation['list'].append('.interrupt');
-      self.functionEvaluation['length'].append(self.interrupt['length']);
-      self.functionEvaluation['body'].append(self.interrupt['tokens']);
-      self.functionEvaluation['address'].append(nextStart);
-      nextStart = nextStart + self.functionEvaluation['length'][-1];
+      self.callGraph.Add('.interrupt',self.interrupt['length'],self.interrupt['tokens'],0);
     # ".main" is always required.
-    self.functionEvaluation['list'].append('.main');
-    self.functionEvaluation['length'].append(self.main['length']);
-    self.functionEvaluation['body'].append(self.main['tokens']);
-    self.functionEvaluation['address'].append(nextStart);
-    nextStart = nextStart + self.functionEvaluation['length'][-1];
+    self.callGraph.Add('.main',self.main['length'],self.main['tokens'],0);
     # Loop through the required function bodies as they are identified.
-    ix = 0;
-    while ix < len(self.functionEvaluation['body']):
-      for token in self.functionEvaluation['body'][ix]:
-        if (token['type'] == 'macro') and (token['value'] in ('.call','.callc',)):
+    for function in self.callGraph:
+      for token in function.body:
+        if (token['type'] == 'macro') and ((token['value'] in ('.call','.callc',)) or token.get('tailcall')):
           callName = token['argument'][0]['value'];
-          if callName not in self.functionEvaluation['list']:
+          if callName not in self.callGraph:
             if not self.IsSymbol(callName):
-              raise asmDef.AsmException('Function "%s" not defined for function "%s"' % (callName,self.functionEvaluation['list'][ix],));
-            ixName = self.symbols['list'].index(callName);
-            if self.symbols['type'][ixName] != 'function':
-              raise asmDef.AsmException('Function "%s" called by "%s" is not a function' % (callName, self.functionEvaluation['list'][ix],));
-            self.functionEvaluation['list'].append(callName);
-            self.functionEvaluation['length'].append(self.symbols['body'][ixName]['length']);
-            self.functionEvaluation['body'].append(self.symbols['body'][ixName]['tokens']);
-            self.functionEvaluation['address'].append(nextStart);
-            nextStart = nextStart + self.functionEvaluation['length'][-1];
-      ix = ix + 1;
-    # Within each function, compute the list of label addresses and then fill in
-    # the address for all jumps and calls.
-    for ix in range(len(self.functionEvaluation['list'])):
-      startAddress = self.functionEvaluation['address'][ix];
-      labelAddress = dict(list=list(), address=list());
-      for token in self.functionEvaluation['body'][ix]:
+              raise asmDef.AsmException('Function "%s" not defined for function "%s"' % (callName,function.name,));
+            symbol = self.symbols[callName];
+            if symbol.type != 'function':
+              raise asmDef.AsmException('Function "%s" called by "%s" is not a function' % (callName,function.name,));
+            self.callGraph.Add(callName,symbol.body['length'],symbol.body['tokens'],function.depth+(0 if token.get('tailcall') else 1));
+          self.callGraph.AddCall(function.name,callName);
+    # Optionally keep the functions at their previous addresses or place them
+    # to fall through into the functions they tail call.
+    relayout = None;
+    self.fallThroughs = list();
+    if previous != None:
+      relayout = self.callGraph.PlaceStable(previous,min(limit,2**13-1) if limit else 2**13-1);
+    elif fallThrough:
+      self.fallThroughs = asmOptimize.FallThrough(self);
+    # Within each function, compute the label addresses and then fill in the
+    # address for all jumps and calls.
+    for function in self.callGraph:
+      for token in function.body:
         if token['type'] == 'label':
-          labelAddress['list'].append(token['value']);
-          labelAddress['address'].append(startAddress + token['offset']);
-      for token in self.functionEvaluation['body'][ix]:
+          function.labels[token['value']] = function.address + token['offset'];
+      for token in function.body:
         if token['type'] != 'macro':
           continue;
-        if token['value'] in ('.jump','.jumpc',):
-          ix = labelAddress['list'].index(token['argument'][0]['value']);
-          token['address'] = labelAddress['address'][ix];
-        elif token['value'] in ('.call','.callc',):
-          ix = self.functionEvaluation['list'].index(token['argument'][0]['value']);
-          token['address'] = self.functionEvaluation['address'][ix];
+        if (token['value'] in ('.call','.callc',)) or token.get('tailcall'):
+          token['address'] = self.callGraph.Address(token['argument'][0]['value']);
+        elif token['value'] in ('.jump','.jumpc',):
+          token['address'] = function.labels[token['argument'][0]['value']];
     # Sanity checks for address range
-    if self.functionEvaluation['address'][-1] + self.functionEvaluation['length'][-1] >= 2**13:
+    if self.callGraph.End() >= 2**13:
       raise asmDef.AsmException('Max address for program requires more than 13 bits');
+    return relayout;
 
   ################################################################################
   #
@@ -827,42 +829,25 @@ class asmDef_9x8:
 
   def EmitMemories(self,fp):
     """
-    Print the memories to the metacode file.\n
-    The first line for each memory has the format
-      :memory type mem_name bank length
-    where
-      type              is RAM or ROM
-      mem_name          is the name of the memory
-      bank              is the assigned bank address
-      length            is the number of bytes used by the memory\n
-    The subsequent lines are sequences of
-      - variable_name
-      value(s)
-    where
-      '-'               indicates a variable name is present
-      variable_name     is the name of the variable
-      values(s)         is one or more lines for the values with one byte per line
-                        Note:  because the lines with variable names start with
-                               '-', negative values are converted to unsigned
-                               values\n
+    Add the memories to the metacode (see asmMetacode.Metacode).\n
+    Each memory is recorded with its type (RAM or ROM), name, assigned bank
+    index, the number of bytes used by the memory, and the list of variables
+    and their initial values in address order.\n
+    Note:  Negative values are converted to unsigned values.
     """
     # Emit the individual memories.
     for ixMem in range(len(self.memories['list'])):
-      fp.write(':memory %s %s %d %d\n' % (self.memories['type'][ixMem],self.memories['list'][ixMem],self.memories['bank'][ixMem],self.memories['length'][ixMem]));
       memName = self.memories['list'][ixMem];
-      address = 0;
-      for ixSymbol in range(len(self.symbols['list'])):
-        if self.symbols['type'][ixSymbol] != 'variable':
-          continue;
-        vBody = self.symbols['body'][ixSymbol];
+      variables = list();
+      for symbol in self.symbols.OfType('variable'):
+        vBody = symbol.body;
         if vBody['memory'] != memName:
           continue;
-        fp.write('- %s\n' % self.symbols['list'][ixSymbol]);
         for v in vBody['value']:
           if not (-128 <=v < 256):
             raise Exception('Program Bug -- value not representable by a byte');
-          fp.write('%02X\n' % (v % 0x100,));
-      fp.write('\n');
+        variables.append([symbol.name,[v % 0x100 for v in vBody['value']]]);
+      fp.AddMemory(self.memories['type'][ixMem],memName,self.memories['bank'][ixMem],self.memories['length'][ixMem],variables);
 
   ################################################################################
   #
@@ -873,14 +858,14 @@ class asmDef_9x8:
   #
   # Utilities for building opcodes or the associated description strings.
   #
-  # Note:  These utilities do not write to the metacode file.
+  # Note:  These utilities do not write to the metacode.
   #
 
   def Emit_AddLabel(self,name):
     """
     Append the label to the labels associated with the current program address.
     """
-    self.emitLabelList += ':' + name + ' ';
+    self.emitLabelList.append(name);
 
   def Emit_EvalSingleValue(self,token):
     """
@@ -892,10 +877,10 @@ class asmDef_9x8:
       name = token['value'];
       if not self.IsSymbol(name):
         raise Exception('Program Bug');
-      ix = self.symbols['list'].index(name);
-      if len(self.symbols['body'][ix]) != 1:
+      body = self.symbols[name].body;
+      if len(body) != 1:
         raise asmDef.AsmException('Optional constant can only be one byte at %s' % token['loc']);
-      return self.symbols['body'][ix][0]
+      return body[0]
     elif token['type'] == 'value':
       return token['value']
     else:
@@ -912,10 +897,10 @@ class asmDef_9x8:
     name = token['value'];
     if not self.IsSymbol(name):
       raise asmDef.AsmException('"%s" is not a recognized symbol at %s' % (name,token['loc'],));
-    ixName = self.symbols['list'].index(name);
-    if self.symbols['type'][ixName] != 'variable':
+    symbol = self.symbols[name];
+    if symbol.type != 'variable':
       raise asmDef.AsmException('"%s" is not a variable at %s' % (name,token['loc'],));
-    body = self.symbols['body'][ixName];
+    body = symbol.body;
     bankName = body['memory'];
     ixMem = self.memories['list'].index(bankName);
     return (body['start'],self.memories['bank'][ixMem],bankName,);
@@ -931,13 +916,21 @@ class asmDef_9x8:
     ixMem = self.memories['list'].index(name);
     return self.memories['bank'][ixMem];
 
+  def Emit_Labels(self):
+    """
+    Return the list of labels for the current instruction and restart the list
+    of labels.
+    """
+    labels = self.emitLabelList;
+    self.emitLabelList = list();
+    return labels;
+
   def Emit_String(self,name=''):
     """
-    Append the specified string to the list of labels for the current
-    instruction, restart the list of labels, and return the composite string.
+    Return the comment string for the current instruction.\n
+    Note:  The labels for the current instruction are recorded separately in
+           the metacode when the instruction is emitted.
     """
-    name = self.emitLabelList + name;
-    self.emitLabelList = '';
     return name;
 
   def Emit_IntegerValue(self,token):
@@ -950,8 +943,7 @@ class asmDef_9x8:
       name = token['value'];
       if not self.IsSymbol(name):
         raise asmDef.AsmException('Symbol "%s" not recognized at %s' % (token['value'],token['loc'],));
-      ix = self.symbols['list'].index(name);
-      v = self.symbols['body'][ix];
+      v = self.symbols[name].body;
       if len(v) != 1:
         raise asmDef.AsmException('Argument can only be one value at %s' % token['loc']);
       v = v[0];
@@ -962,7 +954,7 @@ class asmDef_9x8:
     return v;
 
   #
-  # Utilities to write single instructions to the metacode file.
+  # Utilities to write single instructions to the metacode.
   #
   # Note:  Other than the program header and the function names, these
   #        utilities write the function bodies.
@@ -975,25 +967,18 @@ class asmDef_9x8:
     """
     if not (0 <= opcode < 256):
       raise Exception('Program Bug -- opcode "0x%X" out of range');
-    fp.write('0%02X %s\n' % (opcode,self.Emit_String(name)));
+    fp.AddOpcode(opcode,self.Emit_String(name),self.Emit_Labels());
 
   def EmitParameter(self,fp,token):
     """
-    Write the name (and range) of the specified parameter and the optional
-    associated comment string.\n
-    The string 'p' specifies that the parameter is to be inserted into the
-    instruction body.\n
-    Note:  The comment string may be the empty string if there were no labels
-           immediately preceding the parameter.
+    Write the name (and range) of the specified parameter.\n
+    The parameter slot is converted into an instruction body when the
+    instruction memory is generated.
     """
     name = token['value'];
     if not self.IsParameter(name):
       raise Exception('Program Bug');
-    commentString = self.Emit_String();
-    if commentString:
-      fp.write('p %s%s %s\n' % (name,token['range'],commentString,));
-    else:
-      fp.write('p %s%s\n' % (name,token['range'],));
+    fp.AddParameter('%s%s' % (name,token['range'],),self.Emit_Labels());
 
   def EmitPush(self,fp,value,name=None,tokenLoc=None):
     """
@@ -1015,11 +1000,12 @@ class asmDef_9x8:
     if value < 0:
       value = value + 256;
     if type(name) == str:
-      fp.write('1%02X %s\n' % ((value % 0x100),self.Emit_String(name)));
+      comment = self.Emit_String(name);
     elif (chr(value) in string.printable) and (chr(value) not in string.whitespace):
-      fp.write('1%02X %s\n' % ((value % 0x100),self.Emit_String('%02X \'%c\'' % (value,value,))));
+      comment = self.Emit_String('%02X \'%c\'' % (value,value,));
     else:
-      fp.write('1%02X %s\n' % ((value % 0x100),self.Emit_String('0x%02X' % value)));
+      comment = self.Emit_String('0x%02X' % value);
+    fp.AddOpcode(0x100 | (value % 0x100),comment,self.Emit_Labels());
 
   def EmitVariable(self,fp,name):
     """
@@ -1028,10 +1014,10 @@ class asmDef_9x8:
     """
     if not self.IsSymbol(name):
       raise asmDef.AsmException('Variable "%s" not recognized' % name);
-    ixName = self.symbols['list'].index(name);
-    if self.symbols['type'][ixName] != 'variable':
+    symbol = self.symbols[name];
+    if symbol.type != 'variable':
       raise asmDef.AsmException('"%s" is not a variable' % name);
-    self.EmitPush(fp,self.symbols['body'][ixName]['start'],name);
+    self.EmitPush(fp,symbol.body['start'],name);
 
   #
   # EmitOpcode, EmitMacro, and EmitProgram emit composite or more complicated
@@ -1053,16 +1039,15 @@ class asmDef_9x8:
       name = token['value'];
       if not self.IsSymbol(name):
         raise Exception('Program Bug');
-      ix = self.symbols['list'].index(name);
-      if len(self.symbols['body'][ix]) != 1:
+      body = self.symbols[name].body;
+      if len(body) != 1:
         raise asmDef.AsmException('Optional constant can only be one byte at %s' % token['loc']);
-      self.EmitPush(fp,self.symbols['body'][ix][0],self.Emit_String(name),tokenLoc=token['loc']);
+      self.EmitPush(fp,body[0],self.Emit_String(name),tokenLoc=token['loc']);
     elif token['type'] in ('inport','outport','outstrobe'):
       name = token['value'];
       if not self.IsSymbol(name):
         raise Exception('Program Bug -- unrecognized inport/outport name "%s"');
-      ix = self.symbols['list'].index(name);
-      self.EmitPush(fp,self.symbols['body'][ix],self.Emit_String(name));
+      self.EmitPush(fp,self.symbols[name].body,self.Emit_String(name));
     elif token['type'] == 'instruction':
       self.EmitOpcode(fp,self.InstructionOpcode(token['value']),token['value']);
     elif token['type'] == 'parameter':
@@ -1166,53 +1151,44 @@ class asmDef_9x8:
 
   def EmitProgram(self,fp):
     """
-    Write the program to the metacode file.\n
-    The frist line for the program has the format
-      :program address_main address_interrupt
-    where
-      address_main      is the address of the .main function (this should be 0)
-      address_interrupt is either the address of the optional interrupt
-                        function if it was defined or the 2-character string
-                        '[]'\n
-    The subsequent lines are sequences of
-      - function_name   indicates the start of a new function body and the name
-                        of the function
-      instructions      is multiple lines, one for each instruction in the
-                        function\n
-    The formats of the instruction lines are as follows:
-      value string      value is the next instruction to store and string is an
-                        optional string describing the instruction
-                        Note:  "value" must be a 3-digit hex string
-                               representing a 9-bit value
-                        Note:  The only place string should be empty is when
-                               pushing the 8 lsb of an address onto the start
-                               prior to a call, callc, jump, or jumpc
-                               instruction
-      p name            the single 'p' means that the name of a parameter and
-                        its range are to be converted into an instruction
-    """
-    # Write the program marker, address of .main, address or "[]" of .interrupt,
-    # and the total program length.
-    fp.write(':program');
+    Write the program to the metacode (see asmMetacode.Metacode).\n
+    The program is recorded with the address of the .main function (this should
+    be 0), the address of the optional .interrupt function or None, and the
+    total program length.\n
+    The instructions are recorded in the function bodies as 9-bit opcodes with
+    an associated comment, the labels for the instruction addresses, and the
+    parameter slots.  A parameter slot means that the name of a parameter and
+    its range are to be converted into an instruction.\n
+    Gaps between the functions, which are left by a stable placement (see
+    EvaluateFunctionTree), are filled with "nop" instructions.\n
+    Note:  The only place the comment should be empty is when pushing the 8 lsb
+           of an address onto the start prior to a call, callc, jump, or jumpc
+           instruction
+    """
+    # Record the address of .main, the address of the optional .interrupt, and
+    # the total program length.
+    programLength = self.callGraph.End();
     if self.interrupt:
-      fp.write(' %d' % self.functionEvaluation['address'][1]);  # .main
-      fp.write(' %d' % self.functionEvaluation['address'][0]);  # .interrupt
+      fp.SetProgram(self.callGraph.Address('.main'),self.callGraph.Address('.interrupt'),programLength);
     else:
-      fp.write(' %d' % self.functionEvaluation['address'][0]);  # .main
-      fp.write(' []');                                          # no .interrupt
-    fp.write(' %d' % (self.functionEvaluation['address'][-1] + self.functionEvaluation['length'][-1]));
-    fp.write('\n');
+      fp.SetProgram(self.callGraph.Address('.main'),None,programLength);
     # Emit the bodies
+    self.emitLabelList = list();
     if self.interrupt:
-      self.emitLabelList = '';
-      mainAddress = self.functionEvaluation['address'][1];
+      mainAddress = self.callGraph.Address('.main');
       self.EmitPush(fp,mainAddress & 0xFF,name='');
       self.EmitOpcode(fp,self.specialInstructions['jump'] | (mainAddress >> 8),'jump .main');
       self.EmitOpcode(fp,self.InstructionOpcode('nop'),'nop');
-    for ix in range(len(self.functionEvaluation['list'])):
-      fp.write('- %s\n' % self.functionEvaluation['list'][ix]);
-      self.emitLabelList = '';
-      for token in self.functionEvaluation['body'][ix]:
+    address = self.callGraph.start;
+    for function in self.callGraph.ByAddress():
+      if address < function.address:
+        fp.StartFunction(None);
+        for ix in range(function.address - address):
+          self.EmitOpcode(fp,self.InstructionOpcode('nop'),'padding');
+      address = function.address + function.length;
+      fp.StartFunction(function.name);
+      self.emitLabelList = list();
+      for token in function.body:
         if token['type'] == 'value':
           self.EmitPush(fp,token['value'],tokenLoc=token['loc']);
         elif token['type'] == 'label':
@@ -1220,16 +1196,14 @@ class asmDef_9x8:
         elif token['type'] == 'constant':
           if not self.IsSymbol(token['value']):
             raise Exception('Program Bug');
-          ix = self.symbols['list'].index(token['value']);
-          body = self.symbols['body'][ix];
+          body = self.symbols[token['value']].body;
           self.EmitPush(fp,body[-1],token['value'],tokenLoc=token['loc']);
           for v in body[-2::-1]:
             self.EmitPush(fp,v,tokenLoc=token['loc']);
         elif token['type'] in ('inport','outport','outstrobe',):
           if not self.IsSymbol(token['value']):
             raise Exception('Program Bug');
-          ix = self.symbols['list'].index(token['value']);
-          self.EmitPush(fp,self.symbols['body'][ix],token['value'],tokenLoc=token['loc']);
+          self.EmitPush(fp,self.symbols[token['value']].body,token['value'],tokenLoc=token['loc']);
         elif token['type'] == 'instruction':
           self.EmitOpcode(fp,self.InstructionOpcode(token['value']),token['value']);
         elif token['type'] == 'macro':
@@ -1341,7 +1315,7 @@ class asmDef_9x8:
     #        expanded.
     #
 
-    self.macros = dict(list=list(), length=list(), args=list(), nArgs=list(), builtIn = list(), doc = list());
+    self.macros = dict();
     self.EmitFunction = dict();
 
     # Macros built in to the assembler (to access primitives).
@@ -1370,13 +1344,14 @@ class asmDef_9x8:
     self.AddMacro('.store-',            1, [ ['','symbol'] ]);
 
     # User-defined macros in ./macros that are "built in" to the assembler.
-    macroSearchPath = os.path.join(sys.path[0],'macros');
+    self.macroFiles = list();
+    macroSearchPath = os.path.join(os.path.dirname(os.path.abspath(__file__)),'macros');
     for macroName in os.listdir(macroSearchPath):
       if not re.match(r'.*\.py$',macroName):
         continue;
       self.AddUserMacro(macroName[:-3],macroSearchPaths=[macroSearchPath]);
-    for macroName in self.macros['list']:
-      self.macros['builtIn'].append(macroName);
+    for macro in self.macros.itervalues():
+      macro.builtIn = True;
 
     #
     # List the macros that have special symbols for their first argument.
@@ -1391,6 +1366,13 @@ class asmDef_9x8:
     self.memoryLength = dict();
     self.stackLength = dict();
 
+    #
+    # Namespace for evaluating "${...}" expressions.
+    #
+
+    self.symbolNamespace = dict(size=dict());
+    self.symbolSizeConflicts = list();
+
     #
     # Conditional implementation of interrupts.
     #
@@ -1414,4 +1396,4 @@ class asmDef_9x8:
     self.interrupt = None;
     self.main = None;
     self.macroSearchPaths = ['.','./macros'];
-    self.symbols = dict(list=list(), type=list(), body=list());
+    self.symbols = asmDef.SymbolTable();
@@ -0,0 +1,206 @@
+################################################################################
+#
+# Copyright 2015, Sinclair R.F., Inc.
+#
+# Structured metacode produced by the SSBCC 9x8 assembler.
+#
+################################################################################
+
+import array
+import json
+
+# Identification and version of the metacode file format.
+METACODE_FORMAT = 'ssbcc-9x8-metacode';
+METACODE_VERSION = 1;
+
+class MetacodeException(Exception):
+  """
+  Exception for malformed metacode files.
+  """
+  def __init__(self,message):
+    self.msg = message;
+  def __str__(self):
+    return self.msg;
+
+class Metacode:
+  """
+  Container for the memories and the program generated by the assembler.\n
+  The memories are a list of dicts with the following content:
+    type        'RAM' or 'ROM'
+    name        name of the memory
+    bank        assigned bank index
+    length      number of bytes used by the memory
+    variables   list of [variable_name, [values]] pairs in address order where
+                the values are unsigned bytes\n
+  The program is a dict with the following content:
+    main        address of the .main function
+    interrupt   address of the optional .interrupt function or None
+    length      total number of instructions in the program\n
+  The instructions are stored as a program image indexed by the instruction
+  address:
+    opcodes     array of the 9-bit opcodes, 0 for parameter slots
+    comments    list of the comments for the opcodes
+    labels      dict of the lists of the labels for the addresses with labels
+    parameters  dict of the parameter names and ranges for the parameter slots
+    functions   list of [name, address] pairs for the starts of the function
+                bodies in address order where the name is None for the
+                instructions preceding the first function (i.e., the jump to
+                .main when interrupts are enabled) and for the padding between
+                functions
+  """
+
+  def __init__(self):
+    self.memories = list();
+    self.program = None;
+    self.opcodes = array.array('H');
+    self.comments = list();
+    self.labels = dict();
+    self.parameters = dict();
+    self.functions = list();
+
+  ##############################################################################
+  #
+  # Methods used by the assembler to construct the metacode.
+  #
+  ##############################################################################
+
+  def AddMemory(self,memType,name,bank,length,variables):
+    """
+    Add a memory and its initial values to the metacode.
+    """
+    self.memories.append(dict(type=memType, name=name, bank=bank, length=length, variables=variables));
+
+  def SetProgram(self,main,interrupt,length):
+    """
+    Start the program with the addresses of the .main and optional .interrupt
+    functions and the total program length.
+    """
+    self.program = dict(main=main, interrupt=interrupt, length=length);
+    self.StartFunction(None);
+
+  def StartFunction(self,name):
+    """
+    Start the body of the named function.
+    """
+    address = len(self.opcodes);
+    if self.functions and not self.functions[-1][0] and (self.functions[-1][1] == address):
+      self.functions.pop();
+    self.functions.append([name,address]);
+
+  def AddOpcode(self,opcode,comment,labels):
+    """
+    Append an opcode, its comment, and the labels for its address to the
+    program.
+    """
+    if labels:
+      self.labels.setdefault(len(self.opcodes),list()).extend(labels);
+    self.opcodes.append(opcode);
+    self.comments.append(comment);
+
+  def AddParameter(self,parameter,labels):
+    """
+    Append a parameter slot and the labels for its address to the program.
+    """
+    self.parameters[len(self.opcodes)] = parameter;
+    self.AddOpcode(0,'',labels);
+
+  ##############################################################################
+  #
+  # Methods used to access the metacode.
+  #
+  ##############################################################################
+
+  def ProgramLength(self):
+    """
+    Return the number of instructions in the function bodies.
+    """
+    return len(self.opcodes);
+
+  def Functions(self):
+    """
+    Return the list of (name,address,length) tuples for the function bodies in
+    address order.
+    """
+    ends = [address for (name,address) in self.functions[1:]] + [len(self.opcodes)];
+    return [(name,address,end-address,) for ((name,address),end) in zip(self.functions,ends)];
+
+  def Comment(self,address):
+    """
+    Return the comment for the instruction, including the labels for its
+    address.
+    """
+    if address in self.labels:
+      return ''.join(':%s ' % label for label in self.labels[address]) + self.comments[address];
+    return self.comments[address];
+
+  ##############################################################################
+  #
+  # Write and read the metacode file.
+  #
+  # The file consists of JSON records, one per line.  The first record
+  # identifies the format and its version, this is followed by one record per
+  # memory, a record for the program, and one record per function body.  In
+  # the function bodies, parameter slots have the opcode null and the labels
+  # and parameters are listed as [offset, value] pairs.
+  #
+  ##############################################################################
+
+  def Write(self,fp):
+    """
+    Write the metacode to the file.
+    """
+    def Record(record):
+      return json.dumps(record, sort_keys=True, separators=(',',':')) + '\n';
+    records = [Record(dict(format=METACODE_FORMAT, version=METACODE_VERSION))];
+    for memory in self.memories:
+      records.append(Record(dict(memory=memory)));
+    records.append(Record(dict(program=self.program)));
+    for (name,address,length) in self.Functions():
+      end = address + length;
+      opcodes = self.opcodes[address:end].tolist();
+      labels = list();
+      parameters = list();
+      for ixAddress in range(address,end):
+        for label in self.labels.get(ixAddress,()):
+          labels.append([ixAddress-address,label]);
+        if ixAddress in self.parameters:
+          opcodes[ixAddress-address] = None;
+          parameters.append([ixAddress-address,self.parameters[ixAddress]]);
+      records.append(Record(dict(function=dict(name=name, address=address, opcodes=opcodes, comments=self.comments[address:end], labels=labels, parameters=parameters))));
+    fp.write(''.join(records));
+
+def ReadMetacode(fp):
+  """
+  Read a metacode file written by Metacode.Write.
+  """
+  metacode = Metacode();
+  header = None;
+  for line in fp:
+    record = json.loads(line);
+    if not header:
+      header = record;
+      if header.get('format') != METACODE_FORMAT:
+        raise MetacodeException('"%s" is not a metacode file' % fp.name);
+      if header.get('version') != METACODE_VERSION:
+        raise MetacodeException('Metacode version %s in "%s" is not version %d' % (header.get('version'),fp.name,METACODE_VERSION,));
+    elif 'memory' in record:
+      metacode.memories.append(record['memory']);
+    elif 'program' in record:
+      metacode.program = record['program'];
+    elif 'function' in record:
+      body = record['function'];
+      address = len(metacode.opcodes);
+      if body['address'] != address:
+        raise MetacodeException('Function "%s" in "%s" is not at address %d' % (body['name'],fp.name,address,));
+      metacode.functions.append([body['name'],address]);
+      for offset,label in body['labels']:
+        metacode.labels.setdefault(address+offset,list()).append(label);
+      for offset,parameter in body['parameters']:
+        metacode.parameters[address+offset] = parameter;
+      metacode.opcodes.extend([0 if opcode == None else opcode for opcode in body['opcodes']]);
+      metacode.comments.extend(body['comments']);
+    else:
+      raise MetacodeException('Unrecognized record in "%s":  %s' % (fp.name,line,));
+  if not header or not metacode.program:
+    raise MetacodeException('Incomplete metacode file "%s"' % fp.name);
+  return metacode;
@@ -0,0 +1,277 @@
+################################################################################
+#
+# Copyright 2015, Sinclair R.F., Inc.
+#
+# Relocatable objects produced by the SSBCC 9x8 assembler.
+#
+################################################################################
+
+import json
+
+import asmDef
+from ssbccUtil import ExprNames
+
+# Identification and version of the object file format.
+OBJECT_FORMAT = 'ssbcc-9x8-object';
+OBJECT_VERSION = 1;
+
+# File name extension identifying object files in the assembler's file list.
+OBJECT_SUFFIX = '.9x8-obj';
+
+def IsObjectFile(filename):
+  """
+  Indicate whether or not the named assembler input is an object file.
+  """
+  return filename.endswith(OBJECT_SUFFIX);
+
+def EnvironmentSignature(symbol):
+  """
+  Return the properties of a symbol defined outside of an object that the
+  object depends on.\n
+  Note:  Function bodies and the addresses of variables are resolved when the
+         program is linked, so they are not part of the signature.  The
+         addresses of variables used in "${...}" expressions are checked
+         separately.
+  """
+  if symbol.type in ('constant','inport','outport','outstrobe',):
+    return symbol.body;
+  elif symbol.type == 'variable':
+    return [symbol.body['memory'],len(symbol.body['value'])];
+  else:
+    return None;
+
+def Str(value):
+  """
+  Convert the unicode strings in the value read from an object file back to
+  the strings produced by the assembler.
+  """
+  if type(value) == unicode:
+    return str(value);
+  elif type(value) == list:
+    return [Str(v) for v in value];
+  elif type(value) == dict:
+    return dict((str(key),Str(v)) for key,v in value.iteritems());
+  else:
+    return value;
+
+class Object:
+  """
+  Relocatable object for a source file:  the result of the first stage of the
+  assembler for the source file and its .included files.\n
+  The object has the following content:
+    name          name of the object file
+    sources       source and macro files read to assemble the object
+    environment   list of [name, type, signature] lists for the symbols defined
+                  before the source file, i.e., on the command line or by the
+                  imported objects (see EnvironmentSignature)
+    sizes         memory and stack lengths provided on the command line
+    undefined     names of the symbols tested by .IFDEF, .ifdef, etc. and found
+                  not to be defined
+    addresses     list of [name, address] lists for the variables whose
+                  addresses were used in "${...}" expressions
+    macros        names of the user-defined macros loaded by the source file
+    definitions   list of [name, type, body, loc] lists for the symbols defined
+                  by the source file in the order in which they were defined
+    main          body of the .main function or None
+    interrupt     body of the .interrupt function or None
+    memory        name of the memory for subsequent .variable directives\n
+  The bodies of the functions have their .call and .jump targets unresolved
+  and the variables are placed in their memories when the object is linked.
+  """
+
+  def __init__(self,name):
+    self.name = name;
+    self.sources = list();
+    self.environment = list();
+    self.sizes = dict();
+    self.undefined = list();
+    self.addresses = list();
+    self.macros = list();
+    self.definitions = list();
+    self.main = None;
+    self.interrupt = None;
+    self.memory = None;
+
+  ##############################################################################
+  #
+  # Methods used by the assembler to construct the object.
+  #
+  ##############################################################################
+
+  def Begin(self,ad):
+    """
+    Record the environment the source file is assembled in.\n
+    Note:  This must be called after the command-line symbols are defined and
+           the imported objects are linked and before the source file is
+           assembled.
+    """
+    self.environment = [[symbol.name,symbol.type,EnvironmentSignature(symbol)] for symbol in ad.symbols.All()];
+    self.sizes = dict(ad.memoryLength);
+    self.sizes.update(ad.stackLength);
+    self.nEnvironment = len(ad.symbols);
+    self.nMacroFiles = len(ad.macroFiles);
+    self.macrosBefore = set(ad.macros);
+
+  def End(self,ad,sourceFiles,consultations):
+    """
+    Record the symbols and bodies defined by the source file.\n
+    sourceFiles     list of the source files read, including .included files
+    consultations   consultations made while generating the raw tokens (see
+                    asmDef.FileBodyIterator) and by .IFDEF and .IFNDEF
+    """
+    self.sources = sourceFiles + ad.macroFiles[self.nMacroFiles:];
+    for kind,name,value in consultations:
+      if kind == 'symbol' and not value and name not in self.undefined:
+        self.undefined.append(name);
+      elif kind == 'expr':
+        for exprName in ExprNames(name):
+          if exprName in ad.symbols and ad.symbols[exprName].type == 'variable' \
+             and exprName not in [address[0] for address in self.addresses]:
+            self.addresses.append([exprName,ad.symbols[exprName].body['start']]);
+    self.macros = sorted([name for name in ad.macros if name not in self.macrosBefore]);
+    for symbol in ad.symbols.All()[self.nEnvironment:]:
+      body = symbol.body;
+      if symbol.type == 'variable':
+        body = dict(memory=body['memory'], value=body['value']);
+      elif symbol.type in ('RAM','ROM',):
+        body = dict(length=0);
+      self.definitions.append([symbol.name,symbol.type,body,symbol.loc]);
+    self.main = ad.main;
+    self.interrupt = ad.interrupt;
+    self.memory = ad.currentMemory;
+
+  ##############################################################################
+  #
+  # Link the object into the program.
+  #
+  ##############################################################################
+
+  def Link(self,ad):
+    """
+    Add the symbols and bodies defined by the object to the assembler.\n
+    The object must have been assembled in the same environment, i.e., with
+    the same command-line symbols and with the same symbols defined by the
+    preceding objects and source files.  The variables are appended to their
+    memories.
+    """
+    def Stale(reason):
+      raise asmDef.AsmException('Object "%s" %s -- reassemble it' % (self.name,reason,));
+    # Ensure the environment is unchanged.
+    for name,stype,signature in self.environment:
+      if name not in ad.symbols:
+        Stale('requires the undefined symbol "%s"' % name);
+      symbol = ad.symbols[name];
+      if (symbol.type != stype) or (EnvironmentSignature(symbol) != signature):
+        Stale('was assembled with a different definition of "%s"' % name);
+    for name in self.undefined:
+      if name in ad.symbols:
+        Stale('was assembled without the symbol "%s"' % name);
+    for name in self.sizes:
+      length = ad.memoryLength.get(name,ad.stackLength.get(name));
+      if length != self.sizes[name]:
+        Stale('was assembled with a different length for "%s"' % name);
+    # Load the user-defined macros.
+    for name in self.macros:
+      if name not in ad.macros:
+        ad.AddUserMacro(name[1:]);
+    # Add the symbols, placing the variables in their memories.  Memories can
+    # be declared by more than one object, as with repeated ".memory"
+    # directives.
+    for name,stype,body,loc in self.definitions:
+      if name in ad.symbols:
+        if (stype in ('RAM','ROM',)) and (ad.symbols[name].type == stype):
+          continue;
+        raise asmDef.AsmException('Symbol "%s" defined at %s is already defined' % (name,loc,));
+      if stype == 'variable':
+        memoryBody = ad.symbols[body['memory']].body;
+        body = dict(memory=body['memory'], start=memoryBody['length'], value=body['value']);
+        memoryBody['length'] = memoryBody['length'] + len(body['value']);
+        if memoryBody['length'] > 256:
+          raise asmDef.AsmException('Memory "%s" becomes too long at %s' % (body['memory'],loc,));
+      elif stype in ('RAM','ROM',):
+        body = dict(length=0);
+      ad.AddSymbol(name,stype,body,loc);
+    for name,address in self.addresses:
+      if ad.symbols[name].body['start'] != address:
+        Stale('requires variable "%s" at address %d' % (name,address,));
+    if self.main:
+      if ad.main:
+        raise asmDef.AsmException('Second definition of ".main" in "%s"' % self.name);
+      ad.main = self.main;
+    if self.interrupt:
+      if ad.interrupt:
+        raise asmDef.AsmException('Second definition of ".interrupt" in "%s"' % self.name);
+      ad.interrupt = self.interrupt;
+    if self.memory:
+      ad.currentMemory = self.memory;
+
+  ##############################################################################
+  #
+  # Write and read the object file.
+  #
+  # The file consists of JSON records, one per line.  The first record
+  # identifies the format and its version, this is followed by a record with
+  # the environment, one record per definition, and a record for each of the
+  # .main and .interrupt bodies.
+  #
+  ##############################################################################
+
+  def Write(self,fp):
+    """
+    Write the object to the file.
+    """
+    def WriteRecord(record):
+      fp.write(json.dumps(record, sort_keys=True, separators=(',',':')));
+      fp.write('\n');
+    WriteRecord(dict(format=OBJECT_FORMAT, version=OBJECT_VERSION));
+    WriteRecord(dict(environment=dict(sources=self.sources, symbols=self.environment, sizes=self.sizes, undefined=self.undefined, addresses=self.addresses, macros=self.macros, memory=self.memory)));
+    for definition in self.definitions:
+      WriteRecord(dict(definition=definition));
+    if self.main:
+      WriteRecord(dict(main=self.main));
+    if self.interrupt:
+      WriteRecord(dict(interrupt=self.interrupt));
+
+def ReadObject(filename):
+  """
+  Read an object file written by Object.Write.
+  """
+  try:
+    fp = open(filename,'rt');
+  except:
+    raise asmDef.AsmException('Error opening "%s"' % filename);
+  obj = Object(filename);
+  header = None;
+  environment = None;
+  for line in fp:
+    try:
+      record = Str(json.loads(line));
+    except ValueError:
+      raise asmDef.AsmException('Malformed object file "%s"' % filename);
+    if not header:
+      header = record;
+      if header.get('format') != OBJECT_FORMAT:
+        raise asmDef.AsmException('"%s" is not an object file' % filename);
+      if header.get('version') != OBJECT_VERSION:
+        raise asmDef.AsmException('Object version %s in "%s" is not version %d' % (header.get('version'),filename,OBJECT_VERSION,));
+    elif 'environment' in record:
+      environment = record['environment'];
+      obj.sources = environment['sources'];
+      obj.environment = environment['symbols'];
+      obj.sizes = environment['sizes'];
+      obj.undefined = environment['undefined'];
+      obj.addresses = environment['addresses'];
+      obj.macros = environment['macros'];
+      obj.memory = environment['memory'];
+    elif 'definition' in record:
+      obj.definitions.append(record['definition']);
+    elif 'main' in record:
+      obj.main = record['main'];
+    elif 'interrupt' in record:
+      obj.interrupt = record['interrupt'];
+    else:
+      raise asmDef.AsmException('Unrecognized record in "%s":  %s' % (filename,line,));
+  fp.close();
+  if not header or not environment:
+    raise asmDef.AsmException('Incomplete object file "%s"' % filename);
+  return obj;
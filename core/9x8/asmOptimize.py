@@ -0,0 +1,569 @@
+################################################################################
+#
+# Copyright 2015, Sinclair R.F., Inc.
+#
+# Optimization passes over the expanded bodies of the SSBCC 9x8 assembler.
+#
+################################################################################
+
+# Peephole rewrites.
+#
+# Each rewrite is a name, the sequence of tokens it matches, and the sequence of
+# tokens it is replaced by.  The elements of the matched sequence are:
+#   'push'      a single-instruction push, i.e., a value, a port, a variable, a
+#               parameter, or a single-byte constant
+#   '0', '1'    a push of the value 0 or 1
+#   '.name'     an invocation of the named macro
+#   other       the named instruction
+# A ":N" suffix further requires the token to have the same value or macro
+# arguments as the N'th matched token.  The elements of the replacement are
+# either the index of a matched token, which is retained, or the name of an
+# instruction.
+#
+# Note:  Labels never match, so a rewrite never spans a jump target.
+# Note:  The memory rewrites are not made in programs with an ".interrupt" body
+#        since the interrupt can store to the variable between the two
+#        instructions.
+PEEPHOLE_REWRITES = (
+  ('push drop',         ('push','drop',),                       (),),
+  ('dup drop',          ('dup','drop',),                        (),),
+  ('swap swap',         ('swap','swap',),                       (),),
+  ('>r r>',             ('>r','r>',),                           (),),
+  ('r> >r',             ('r>','>r',),                           (),),
+  ('0 +',               ('0','+',),                             (),),
+  ('0 -',               ('0','-',),                             (),),
+  ('0 or',              ('0','or',),                            (),),
+  ('0 ^',               ('0','^',),                             (),),
+  ('1 +',               ('1','+',),                             ('1+',),),
+  ('1 -',               ('1','-',),                             ('1-',),),
+  ('1+ 1-',             ('1+','1-',),                           (),),
+  ('1- 1+',             ('1-','1+',),                           (),),
+  ('swap drop',         ('swap','drop',),                       ('nip',),),
+  ('swap nip',          ('swap','nip',),                        ('drop',),),
+  ('repeated fetch',    ('push','.fetch','push:0','.fetch:1',), (0,1,'dup',),),
+  ('fetch after store', ('push','.store','push:0','.fetch:1',), (0,1,'dup',),),
+);
+
+PEEPHOLE_MEMORY_REWRITES = ('repeated fetch','fetch after store',);
+
+def IsNop(token):
+  """
+  Indicate whether or not the macro argument is the "nop" instruction.
+  """
+  return (token['type'] == 'instruction') and (token['value'] == 'nop');
+
+def IsPush(ad,token):
+  """
+  Indicate whether or not the expanded token is a single-instruction push.
+  """
+  if token['type'] in ('value','inport','outport','outstrobe','parameter','variable',):
+    return True;
+  if token['type'] == 'constant':
+    return len(ad.symbols[token['value']].body) == 1;
+  return False;
+
+def Operand(token):
+  """
+  Return the value pushed by the token or the arguments of the macro.
+  """
+  if token['type'] == 'macro':
+    return [(arg['type'],arg['value'],arg.get('range'),) for arg in token['argument']];
+  return (token['type'],token['value'],token.get('range'),);
+
+def TokenLengths(body):
+  """
+  Return the number of instructions generated by each token of the expanded
+  body (see asmDef_9x8.ExpandTokens).
+  """
+  tokens = body['tokens'];
+  lengths = list();
+  for ix in range(len(tokens)):
+    if ix+1 < len(tokens):
+      lengths.append(tokens[ix+1]['offset'] - tokens[ix]['offset']);
+    else:
+      lengths.append(body['length'] - tokens[ix]['offset']);
+  return lengths;
+
+def Body(items):
+  """
+  Return the expanded body for the list of (token, length) items, i.e., with
+  the offsets of the tokens computed from their lengths.
+  """
+  tokens = list();
+  offset = 0;
+  for token,length in items:
+    tokens.append(dict(token, offset=offset));
+    offset = offset + length;
+  return dict(tokens=tokens, length=offset);
+
+def MatchElement(ad,element,token,matched):
+  """
+  Indicate whether or not the token matches the element of a peephole rewrite
+  given the previously matched tokens.
+  """
+  if ':' in element:
+    element,ixSame = element.split(':');
+    if Operand(token) != Operand(matched[int(ixSame)]):
+      return False;
+  if element == 'push':
+    return IsPush(ad,token);
+  if element in ('0','1',):
+    return (token['type'] == 'value') and (token['value'] == int(element));
+  if element[0] == '.':
+    return (token['type'] == 'macro') and (token['value'] == element);
+  return (token['type'] == 'instruction') and (token['value'] == element);
+
+def Peephole(ad,body):
+  """
+  Apply the peephole rewrites to the expanded body and return the new body.\n
+  The rewrites in PEEPHOLE_REWRITES are applied until none of them matches,
+  except for the memory rewrites in programs with an ".interrupt" body.
+  Then a ".jump" to a label that only does a ".return" is replaced by the
+  ".return", with the delay-slot instructions of the ".jump" and the ".return"
+  combined where at least one of them is a "nop".
+  """
+  items = zip(body['tokens'],TokenLengths(body));
+  maxLength = max(len(rewrite[1]) for rewrite in PEEPHOLE_REWRITES);
+  ix = 0;
+  while ix < len(items):
+    for name,pattern,replacement in PEEPHOLE_REWRITES:
+      if ix+len(pattern) > len(items):
+        continue;
+      if ad.interrupt and (name in PEEPHOLE_MEMORY_REWRITES):
+        continue;
+      matched = list();
+      for element,(token,length) in zip(pattern,items[ix:ix+len(pattern)]):
+        if not MatchElement(ad,element,token,matched):
+          break;
+        matched.append(token);
+      else:
+        newItems = list();
+        for element in replacement:
+          if type(element) == int:
+            newItems.append(items[ix+element]);
+          else:
+            newItems.append((dict(type='instruction', value=element, loc=matched[0]['loc']),1,));
+        items[ix:ix+len(pattern)] = newItems;
+        # Back up so that the rewrites exposed by this one are also made.
+        ix = max(0,ix-maxLength+1);
+        break;
+    else:
+      ix = ix + 1;
+  # Identify the labels that only do a ".return".
+  returnLabels = dict();
+  for ix in range(len(items)):
+    if items[ix][0]['type'] != 'label':
+      continue;
+    for token,length in items[ix+1:]:
+      if token['type'] != 'label':
+        break;
+    else:
+      continue;
+    if (token['type'] == 'macro') and (token['value'] == '.return'):
+      returnLabels[items[ix][0]['value']] = token;
+  # Replace jumps to those labels with the ".return".
+  for ix in range(len(items)):
+    token = items[ix][0];
+    if not IsLocalJump(token) or (token['value'] != '.jump') or (token['argument'][0]['value'] not in returnLabels):
+      continue;
+    returnToken = returnLabels[token['argument'][0]['value']];
+    if IsNop(token['argument'][1]):
+      argument = returnToken['argument'][0];
+    elif IsNop(returnToken['argument'][0]):
+      argument = token['argument'][1];
+    else:
+      continue;
+    length = ad.MacroLength(dict(type='macro', value='.return', argument=[argument]));
+    items[ix] = (dict(type='macro', value='.return', argument=[argument], loc=token['loc'], length=length),length,);
+  return Body(items);
+
+def IsCall(token):
+  """
+  Indicate whether or not the expanded token is a call or a tail call to a
+  function.
+  """
+  return (token['type'] == 'macro') and ((token['value'] in ('.call','.callc',)) or bool(token.get('tailcall')));
+
+def TailCalls(ad,body):
+  """
+  Convert the calls immediately followed by a ".return" into jumps to the
+  called functions and return the new body and the number of calls converted.\n
+  The called function then returns directly to the caller's caller, so the
+  ".return" must have the default "nop" in its delay slot.  The delay-slot
+  argument of the call is kept by the jump.  The ".return" following a
+  ".call" converted to a ".jump" is unreachable and is removed unless it is
+  also the target of a jump.  The ".return" following a ".callc" converted to
+  a ".jumpc" is retained for the case where the jump is not taken.\n
+  The jumps are marked with a "tailcall" attribute so that the called function
+  is included in the call graph and its address is used as the jump target.
+  """
+  items = zip(body['tokens'],TokenLengths(body));
+  newItems = list();
+  nConverted = 0;
+  ix = 0;
+  while ix < len(items):
+    token = items[ix][0];
+    if (token['type'] == 'macro') and (token['value'] in ('.call','.callc',)):
+      jx = ix + 1;
+      while (jx < len(items)) and (items[jx][0]['type'] == 'label'):
+        jx = jx + 1;
+      if (jx < len(items)) and (items[jx][0]['type'] == 'macro') and (items[jx][0]['value'] == '.return') and IsNop(items[jx][0]['argument'][0]):
+        value = '.jump' if token['value'] == '.call' else '.jumpc';
+        newItems.append((dict(token, value=value, tailcall=True),items[ix][1],));
+        nConverted = nConverted + 1;
+        ix = ix + 1;
+        if (value == '.jump') and (jx == ix):
+          ix = ix + 1;
+        continue;
+    newItems.append(items[ix]);
+    ix = ix + 1;
+  return (Body(newItems),nConverted,);
+
+def IsLocalJump(token):
+  """
+  Indicate whether or not the expanded token is a jump to a label in the body.
+  """
+  return (token['type'] == 'macro') and (token['value'] in ('.jump','.jumpc',)) and not token.get('tailcall');
+
+def DelaySlot(ad,argument):
+  """
+  Return the list of (token, length) items for the body that are equivalent to
+  a jump, with the specified delay-slot argument, to the following instruction.
+  """
+  if IsNop(argument):
+    return list();
+  if argument['type'] == 'symbol':
+    token = ad.ExpandSymbol(argument,singleValue=True);
+  else:
+    token = dict(argument);
+  return [(token,1,)];
+
+def LabelTargets(items):
+  """
+  Return the index of the token following each label in the list of (token,
+  length) items, skipping other labels.
+  """
+  targets = dict();
+  labels = list();
+  for ix in range(len(items)):
+    if items[ix][0]['type'] == 'label':
+      labels.append(items[ix][0]['value']);
+    else:
+      for label in labels:
+        targets[label] = ix;
+      labels = list();
+  for label in labels:
+    targets[label] = len(items);
+  return targets;
+
+def ThreadJumps(ad,body):
+  """
+  Thread the jumps to unconditional jumps and remove the jumps to the
+  following instruction.  Return the new body, the number of jumps threaded,
+  and the number of jumps removed.\n
+  A jump to a label at a ".jump" is redirected to the target of that ".jump".
+  The delay-slot instruction of the ".jump" at the label must be a "nop",
+  except that for a ".jump" with a "nop" in its own delay slot the
+  delay-slot instruction at the label is used instead.  The targets can be
+  other functions (see TailCalls).\n
+  A ".jump" or ".jumpc" to the following instruction is replaced by its
+  delay-slot instruction.  This also holds for the ".jumpc" since it drops its
+  address whether or not the jump is taken.
+  """
+  items = zip(body['tokens'],TokenLengths(body));
+  nThreaded = 0;
+  nRemoved = 0;
+  targets = LabelTargets(items);
+  for ix in range(len(items)):
+    token = items[ix][0];
+    if not IsLocalJump(token):
+      continue;
+    visited = set();
+    while IsLocalJump(token) and (token['argument'][0]['value'] not in visited):
+      visited.add(token['argument'][0]['value']);
+      jx = targets[token['argument'][0]['value']];
+      if jx == len(items):
+        break;
+      target = items[jx][0];
+      if (target['type'] != 'macro') or (target['value'] != '.jump'):
+        break;
+      if IsNop(target['argument'][1]):
+        argument = token['argument'][1];
+      elif (token['value'] == '.jump') and IsNop(token['argument'][1]):
+        argument = target['argument'][1];
+      else:
+        break;
+      token = dict(token, argument=[target['argument'][0],argument], tailcall=bool(target.get('tailcall')));
+    # Note:  A cycle of jumps can lead back to the original target.
+    if Operand(token) != Operand(items[ix][0]):
+      items[ix] = (token,items[ix][1],);
+      nThreaded = nThreaded + 1;
+  # Remove the jumps to the following instruction one at a time since each
+  # removal changes the indices of the label targets.
+  while True:
+    for ix in range(len(items)):
+      token = items[ix][0];
+      if not IsLocalJump(token):
+        continue;
+      jx = ix + 1;
+      while (jx < len(items)) and (items[jx][0]['type'] == 'label'):
+        jx = jx + 1;
+      if targets[token['argument'][0]['value']] == jx:
+        items[ix:ix+1] = DelaySlot(ad,token['argument'][1]);
+        nRemoved = nRemoved + 1;
+        targets = LabelTargets(items);
+        break;
+    else:
+      break;
+  return (Body(items),nThreaded,nRemoved,);
+
+def FallThrough(ad):
+  """
+  Place each function that ends with a tail call immediately before the called
+  function, where possible, and replace the tail call by its delay-slot
+  instruction so that the function falls through into the called function.
+  Return the list of [caller, callee, instructions saved] lists for the
+  functions placed this way.\n
+  Note:  This must be called after the call graph is constructed and before
+         the addresses of the labels are calculated (see
+         asmDef_9x8.EvaluateFunctionTree).  Functions that are not placed this
+         way stay in the order in which they were added to the call graph.\n
+  Note:  The first function must start the program, so it is never placed
+         after another function.
+  """
+  callGraph = ad.callGraph;
+  ordered = list(callGraph);
+  successors = dict();
+  predecessors = dict();
+  for function in ordered:
+    if not function.body:
+      continue;
+    token = function.body[-1];
+    if (token['type'] != 'macro') or (token['value'] != '.jump') or not token.get('tailcall'):
+      continue;
+    callee = token['argument'][0]['value'];
+    if (callee == ordered[0].name) or (callee in predecessors):
+      continue;
+    # Don't close a cycle of functions falling through into one another.
+    name = callee;
+    while (name != function.name) and (name in successors):
+      name = successors[name];
+    if name == function.name:
+      continue;
+    successors[function.name] = callee;
+    predecessors[callee] = function.name;
+  fallThroughs = list();
+  names = list();
+  for function in ordered:
+    name = function.name;
+    if name in predecessors:
+      continue;
+    names.append(name);
+    while name in successors:
+      caller = callGraph[name];
+      jump = caller.body[-1];
+      delaySlot = [dict(token, offset=jump['offset']) for token,length in DelaySlot(ad,jump['argument'][1])];
+      caller.body = caller.body[:-1] + delaySlot;
+      fallThroughs.append([name,successors[name],caller.length-jump['offset']-len(delaySlot)]);
+      caller.length = jump['offset'] + len(delaySlot);
+      name = successors[name];
+      names.append(name);
+  callGraph.Reorder(names);
+  return fallThroughs;
+
+def CallDepth(ad):
+  """
+  Return the maximum number of return addresses pushed onto the return stack
+  by nested calls, including the return address pushed by the interrupt, or
+  None if the functions are recursive.\n
+  Note:  Tail calls do not push a return address and the values pushed onto
+         the return stack by ">r" are not included.
+  """
+  depths = dict();
+  def Depth(name,body):
+    if name in depths:
+      return depths[name];
+    # None marks the function as being evaluated so that recursion is detected.
+    depths[name] = None;
+    depth = 0;
+    for token in body['tokens']:
+      if not IsCall(token):
+        continue;
+      callName = token['argument'][0]['value'];
+      if (callName not in ad.symbols) or (ad.symbols[callName].type != 'function'):
+        continue;
+      callDepth = Depth(callName,ad.symbols[callName].body);
+      if callDepth == None:
+        return None;
+      if not token.get('tailcall'):
+        callDepth = callDepth + 1;
+      depth = max(depth,callDepth);
+    depths[name] = depth;
+    return depth;
+  depth = Depth('.main',ad.main);
+  if (depth != None) and ad.interrupt:
+    interruptDepth = Depth('.interrupt',ad.interrupt);
+    if interruptDepth == None:
+      return None;
+    depth = depth + 1 + interruptDepth;
+  return depth;
+
+def OptimizeBody(ad,name,body,level):
+  """
+  Apply the optimization passes for the optimization level to the named body
+  and return the new body and the list of notes on the tail calls, threaded
+  jumps, and removed jumps (see Optimize).
+  """
+  newBody = Peephole(ad,body);
+  notes = list();
+  if (level >= 2) and (name != '.interrupt'):
+    newBody,nTailCalls = TailCalls(ad,newBody);
+    if nTailCalls:
+      notes.append('%d tail calls' % nTailCalls);
+  if level >= 3:
+    newBody,nThreaded,nRemoved = ThreadJumps(ad,newBody);
+    if nThreaded:
+      notes.append('%d jumps threaded' % nThreaded);
+    if nRemoved:
+      notes.append('%d jumps removed' % nRemoved);
+    # The threaded and removed jumps can expose more peephole rewrites.
+    if nThreaded or nRemoved:
+      newBody = Peephole(ad,newBody);
+  return (newBody,notes,);
+
+def Optimize(ad,level):
+  """
+  Apply the optimization passes for the optimization level to the .main,
+  .interrupt, and function bodies:
+    1   peephole rewrites (see Peephole)
+    2   level 1 and tail calls (see TailCalls) except in the .interrupt body
+    3   level 2 and jump threading (see ThreadJumps) followed by the peephole
+        rewrites exposed by the threading\n
+  Return a dict with the following entries:
+    saved     list of [name, original length, optimized length, notes] lists
+              for the bodies changed by the optimization where the notes list
+              the tail calls, threaded jumps, and removed jumps
+    depth     (original, optimized) maximum return stack depth for calls (see
+              CallDepth) when tail calls are converted, otherwise None\n
+  Note:  The placement of functions so they fall through into the functions
+         they tail call is done with the call graph (see FallThrough).
+  """
+  report = dict(saved=list(), depth=None);
+  if level < 1:
+    return report;
+  def Replace(name,body):
+    newBody,notes = OptimizeBody(ad,name,body,level);
+    if (newBody['length'] < body['length']) or notes:
+      report['saved'].append([name,body['length'],newBody['length'],notes]);
+    return newBody;
+  if level >= 2:
+    depth = CallDepth(ad);
+  if ad.interrupt:
+    ad.interrupt = Replace('.interrupt',ad.interrupt);
+  ad.main = Replace('.main',ad.main);
+  for symbol in ad.symbols.All():
+    if symbol.type == 'function':
+      symbol.body = Replace(symbol.name,symbol.body);
+  if level >= 2:
+    report['depth'] = (depth,CallDepth(ad),);
+  return report;
+
+################################################################################
+#
+# Unit test of the optimization passes (run with the top directory in PYTHONPATH).
+#
+################################################################################
+
+if __name__ == "__main__":
+
+  import asmDef
+  from asmDef_9x8 import asmDef_9x8
+
+  ad = asmDef_9x8(False);
+
+  def Define(lines):
+    rawTokens = asmDef.RawTokens(ad,'test',1,[(line,asmDef.LexLine(line),) for line in lines]);
+    ad.CheckRawTokens(rawTokens);
+    ad.FillRawTokens(rawTokens);
+
+  def Text(body):
+    text = list();
+    for token in body['tokens']:
+      if token['type'] == 'label':
+        text.append(':' + token['value']);
+      elif token['type'] == 'macro':
+        text.append('%s(%s)' % (token['value'],','.join(str(arg['value']) for arg in token['argument']),));
+      else:
+        text.append(str(token['value']));
+    return ' '.join(text);
+
+  def Check(cases):
+    for level,source,expected in cases:
+      name = 'f%d' % len(ad.symbols);
+      Define(['.function %s' % name,'  ' + source]);
+      body,notes = OptimizeBody(ad,name,ad.symbols[name].body,level);
+      if Text(body) != expected:
+        raise Exception('Optimization level %d failed:  "%s" ==> "%s" instead of "%s"' % (level,source,Text(body),expected,));
+      if body['length'] != sum(token.get('length',1) for token in body['tokens'] if token['type'] != 'label'):
+        raise Exception('Optimization level %d failed:  wrong length for "%s"' % (level,source,));
+
+  Define(['.memory RAM ram']);
+  Define(['.variable v 0']);
+  Define(['.function g','  1+ .return']);
+
+  Check((
+    # peephole rewrites
+    (1, '5 drop dup drop swap swap >r r> 0 + 1 + swap drop .return',
+        '1+ nip .return(nop)'),
+    (1, '3 4 swap nip drop .return',
+        '.return(nop)'),
+    (1, 'v .fetch(ram) v .fetch(ram) v .store(ram) v .fetch(ram) .return',
+        'v .fetch(ram) dup v .store(ram) dup .return(nop)'),
+    # rewrites never span a label
+    (1, '5 :l drop 0 .jumpc(l) .return',
+        '5 :l drop 0 .jumpc(l,drop) .return(nop)'),
+    # jumps to a label at a .return and the delay-slot combination
+    (1, '.jump(r,1+) 5 :r .return',
+        '.return(1+) 5 :r .return(nop)'),
+    (1, '.jump(r) 5 :r :s .return(drop) 0 .jumpc(s) .return',
+        '.return(drop) 5 :r :s .return(drop) 0 .jumpc(s,drop) .return(nop)'),
+    (1, '.jump(r,1+) 5 :r .return(drop)',
+        '.jump(r,1+) 5 :r .return(drop)'),
+  ));
+
+  Check((
+    # tail calls
+    (2, '.call(g,1+) .return',
+        '.jump(g,1+)'),
+    (2, '0 .jumpc(r) .call(g) :r .return',
+        '0 .jumpc(r,drop) .jump(g,nop) :r .return(nop)'),
+    (2, '.callc(g) .return',
+        '.jumpc(g,drop) .return(nop)'),
+    (2, '.call(g) .return(drop)',
+        '.call(g,nop) .return(drop)'),
+  ));
+
+  Check((
+    # jump threading and removal
+    (3, '.jump(a,1+) 5 :a .jump(b) 6 :b 7 .return',
+        '.jump(b,1+) 5 :a .jump(b,nop) 6 :b 7 .return(nop)'),
+    (3, '0 .jumpc(a) 5 :a .jump(b,1+) 6 :b 7 .return',
+        '0 .jumpc(a,drop) 5 :a .jump(b,1+) 6 :b 7 .return(nop)'),
+    (3, '0 .jumpc(n,1+) :n 5 .jump(m) 6 :m 7 .return',
+        '0 1+ :n 5 .jump(m,nop) 6 :m 7 .return(nop)'),
+    # tail calls are never confused with local labels of the same name
+    (3, '0 .jumpc(g) .call(g) .return :g .return',
+        '0 .jumpc(g,drop) .jump(g,nop) :g .return(nop)'),
+  ));
+
+  # The interrupt can store to the variable between the fetches.
+  ad = asmDef_9x8(True);
+  Define(['.memory RAM ram']);
+  Define(['.variable v 0']);
+  Define(['.interrupt','  v .store(ram) drop .returni']);
+  Check((
+    (1, 'v .fetch(ram) v .fetch(ram) v .store(ram) v .fetch(ram) .return',
+        'v .fetch(ram) v .fetch(ram) v .store(ram) v .fetch(ram) .return(nop)'),
+  ));
+
+  print 'Unit test passed';
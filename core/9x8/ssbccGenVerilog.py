@@ -222,7 +222,7 @@ def genLocalParam(fp,config):
   fp.write('localparam C_DATA_PTR_WIDTH                        = %4d;\n' % CeilLog2(config.Get('data_stack')));
   fp.write('localparam C_RETURN_WIDTH                          = (C_PC_WIDTH <= 8) ? 8 : C_PC_WIDTH;\n');
 
-def genMemories(fp,fpMemFile,config,programBody):
+def genMemories(fp,fpMemFile,config,metacode):
   """
   Generate the memories for the instructions, data stack, return stack, and the
   memories and the operations to access these memories in this order.
@@ -230,6 +230,7 @@ def genMemories(fp,fpMemFile,config,programBody):
   fp            file handle for the output core
   fpMemFile     file handle for the memory initialization file
                 Note:  This can be used to avoid running synthesis again.
+  metacode      memories and program generated by the assembler
   """
   combines = config.config['combine'];
   # Declare instruction ROM(s).
@@ -262,11 +263,21 @@ def genMemories(fp,fpMemFile,config,programBody):
   fp.write('\n');
   # Initialize the instruction memory.
   (combined,port,packing) = config.GetPacking('INSTRUCTION');
+  # Note:  The initialization is rendered from the program image into lists of
+  #        lines that are written in one piece.
   fp.write('initial begin\n');
-  ixRecordedBody = 0;
+  functionNames = dict();
+  for (name,address,length) in metacode.Functions():
+    if name:
+      functionNames.setdefault(address,list()).append(name);
+  opcodes = metacode.opcodes;
+  parameters = metacode.parameters;
+  programLength = metacode.ProgramLength();
   nbits = combined['memWidth'];
-  ixInstruction = 0;
   instructionBodyLength = packing['length'];
+  rand_instr_mem = config.Get('rand_instr_mem');
+  lines = list();
+  memLines = list();
   for ixBlock in range(instructionMemory['nBlocks']):
     if instructionMemory['nBlocks'] == 1:
       memName = 's_opcodeMemory';
@@ -274,40 +285,37 @@ def genMemories(fp,fpMemFile,config,programBody):
       memName = instructionMemNameFormat % ixBlock;
     if nbits == 9:
       formatp = '  %s[\'h%%0%dX] = { 1\'b1, %%s };' % (memName,instructionAddrWidth,);
-      formatn = '  %s[\'h%%0%dX] = 9\'h%%s; // %%s\n' % (memName,instructionAddrWidth,);
+      formatn = '  %s[\'h%%0%dX] = 9\'h%%03X; // %%s\n' % (memName,instructionAddrWidth,);
       formate = '  %s[\'h%%0%dX] = 9\'h%%03x;\n' % (memName,instructionAddrWidth,);
     else:
       formatp = '  %s[\'h%%0%dX] = { %d\'d0, 1\'b1, %%s };' % (memName,instructionAddrWidth,nbits-9,);
-      formatn = '  %s[\'h%%0%dX] = { %d\'d0, 9\'h%%s }; // %%s\n' % (memName,instructionAddrWidth,nbits-9,);
+      formatn = '  %s[\'h%%0%dX] = { %d\'d0, 9\'h%%03X }; // %%s\n' % (memName,instructionAddrWidth,nbits-9,);
       formate = '  %s[\'h%%0%dX] = { %d\'d0, 9\'h%%03x };\n' % (memName,instructionAddrWidth,nbits-9,);
-    rand_instr_mem = config.Get('rand_instr_mem');
     for ixMem in range(instructionMemory['blockSize']):
       memAddr = instructionMemory['blockSize']*ixBlock+ixMem;
-      if ixRecordedBody < len(programBody):
-        for ixRecordedBody in range(ixRecordedBody,len(programBody)):
-          if programBody[ixRecordedBody][0] == '-':
-            fp.write('  // %s\n' % programBody[ixRecordedBody][2:]);
-          else:
-            if programBody[ixRecordedBody][0] == 'p':
-              (parameterString,parameterComment) = re.findall(r'(\S+)(.*)$',programBody[ixRecordedBody][2:])[0];
-              fp.write(formatp % (ixMem,parameterString,));
-              fpMemFile.write('@%04X %03X\n' % (memAddr,0x100 + config.GetParameterValue(parameterString)));
-              if len(parameterComment) > 0:
-                fp.write(' // %s' % parameterComment[1:]);
-              fp.write('\n');
-            else:
-              fp.write(formatn % (ixMem,programBody[ixRecordedBody][0:3],programBody[ixRecordedBody][4:]));
-              fpMemFile.write('@%04X %s\n' % (memAddr,programBody[ixRecordedBody][0:3],));
-            break;
-        ixRecordedBody = ixRecordedBody + 1;
-      elif ixInstruction < instructionBodyLength:
-        fp.write(formate % (ixMem,0 if not rand_instr_mem else random.randint(0,2**9-1),));
-        fpMemFile.write('@%04X 000\n' % memAddr);
+      if memAddr < programLength:
+        for name in functionNames.get(memAddr,()):
+          lines.append('  // %s\n' % name);
+        comment = metacode.Comment(memAddr);
+        if memAddr in parameters:
+          parameterString = parameters[memAddr];
+          lines.append(formatp % (ixMem,parameterString,));
+          memLines.append('@%04X %03X\n' % (memAddr,0x100 + config.GetParameterValue(parameterString)));
+          if len(comment) > 0:
+            lines.append(' // %s' % comment);
+          lines.append('\n');
+        else:
+          lines.append(formatn % (ixMem,opcodes[memAddr],comment));
+          memLines.append('@%04X %03X\n' % (memAddr,opcodes[memAddr],));
+      elif memAddr < instructionBodyLength:
+        lines.append(formate % (ixMem,0 if not rand_instr_mem else random.randint(0,2**9-1),));
+        memLines.append('@%04X 000\n' % memAddr);
       else:
         break;
-      ixInstruction = ixInstruction + 1;
     # Save the last memory name for memories combined at the end of the instruction memory.
     combined['memName'] = memName;
+  fp.write(''.join(lines));
+  fpMemFile.write(''.join(memLines));
   if len(combined['port']) > 1:
     offset0 = instructionMemory['blockSize']*(instructionMemory['nBlocks']-1);
     combined['port'][1]['offset'] -= offset0;
@@ -599,16 +607,14 @@ def genMemories_init(fp,config,combined,fpMemFile=None,memName=None,memLength=No
         values.append(thisValue);
         curOffset = 0;
         if memParam['body'] != None:
-          for line in memParam['body']:
-            if line[0] == '-':
-              varName = line[2:-1];
-              continue;
-            addr = port['offset']+port['ratio']*curOffset+packing['lane'];
-            thisFill.append({ 'assign':(formatd % (addr,line[0:2],)) });
-            thisFill[-1]['comment'] = varName if varName else '.';
-            thisValue.append(int(line[0:2],16));
-            varName = None;
-            curOffset += 1;
+          for (varName,varValues) in memParam['body']:
+            for value in varValues:
+              addr = port['offset']+port['ratio']*curOffset+packing['lane'];
+              thisFill.append({ 'assign':(formatd % (addr,'%02X' % value,)) });
+              thisFill[-1]['comment'] = varName if varName else '.';
+              thisValue.append(value);
+              varName = None;
+              curOffset += 1;
       if (curOffset > packing['nWords']):
         raise Exception('Program Bug -- memory body longer than allocated memory space');
       while curOffset < packing['length']:
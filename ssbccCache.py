@@ -0,0 +1,193 @@
+################################################################################
+#
+# Copyright 2015, Sinclair R.F., Inc.
+#
+# Content-hash build cache for ssbcc.
+#
+################################################################################
+
+import cPickle
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from ssbccUtil import SSBCCException
+from ssbccUtil import WriteIfChanged
+
+class SSBCCcache:
+  """
+  Build cache for the outputs generated by ssbcc.\n
+  The cache directory contains:
+    manifests/<key>.json    for each combination of configuration file, working
+                            directory, and command-line options, the list of
+                            previous builds with the files each build read and
+                            their hashes
+    results/<hash>/         the outputs generated by one build, where the hash
+                            is computed from the manifest key and the hashes of
+                            the files read by the build\n
+  A build is restored from the cache when all of the files it read still have
+  the recorded hashes.
+  """
+
+  # Cache format version -- change this when the cache layout changes.
+  version = 1;
+
+  # Maximum number of builds remembered for each manifest key.
+  maxEntries = 8;
+
+  def __init__(self,cacheDir,keyValues):
+    """
+    Initialize the cache.\n
+    cacheDir    directory for the cache
+    keyValues   list of JSON-serializable values that, together with the
+                content of the files read by the build, determine the outputs
+    """
+    self.cacheDir = cacheDir;
+    self.key = hashlib.sha1(json.dumps([self.version]+keyValues,sort_keys=True)).hexdigest();
+    self.manifestName = os.path.join(cacheDir,'manifests','%s.json' % self.key);
+    self.fileHashes = dict();
+
+  def FileHash(self,filename):
+    """
+    Return the SHA-1 hash of the file contents or None if the file cannot be
+    read.
+    """
+    if filename not in self.fileHashes:
+      try:
+        fp = open(filename,'rb');
+        self.fileHashes[filename] = hashlib.sha1(fp.read()).hexdigest();
+        fp.close();
+      except IOError:
+        self.fileHashes[filename] = None;
+    return self.fileHashes[filename];
+
+  def ReadManifest(self):
+    """
+    Return the list of builds recorded for the manifest key.
+    """
+    try:
+      fp = open(self.manifestName,'rt');
+      manifest = json.load(fp);
+      fp.close();
+    except (IOError,ValueError):
+      return list();
+    if manifest.get('version') != self.version:
+      return list();
+    return manifest['entries'];
+
+  def MakeDirs(self,dirName):
+    """
+    Create the directory if it doesn't already exist.\n
+    Note:  Concurrent builds may create the directory at the same time.
+    """
+    try:
+      os.makedirs(dirName);
+    except OSError:
+      if not os.path.isdir(dirName):
+        raise;
+
+  def ResultDir(self,result):
+    return os.path.join(self.cacheDir,'results',result);
+
+  def Restore(self):
+    """
+    If a previous build read files whose contents have not changed, then copy
+    its outputs to their original locations and return the list of restored
+    outputs and whether or not each was changed, otherwise return None.\n
+    Note:  Outputs whose contents are unchanged are not touched.
+    """
+    for entry in self.ReadManifest():
+      if any(self.FileHash(filename) != fileHash for (filename,fileHash) in entry['dependencies']):
+        continue;
+      resultDir = self.ResultDir(entry['result']);
+      if not all(os.path.isfile(os.path.join(resultDir,'%d' % ix)) for ix in range(len(entry['outputs']))):
+        continue;
+      restored = list();
+      for ix in range(len(entry['outputs'])):
+        try:
+          fp = open(os.path.join(resultDir,'%d' % ix),'rt');
+          body = fp.read();
+          fp.close();
+        except IOError, msg:
+          raise SSBCCException('Could not read build cache "%s":  %s' % (self.cacheDir,msg,));
+        restored.append((entry['outputs'][ix],WriteIfChanged(entry['outputs'][ix],body),));
+      return restored;
+    return None;
+
+  def Store(self,dependencies,outputs):
+    """
+    Record the outputs of a build and the hashes of the files it read.\n
+    dependencies        list of the files read by the build
+    outputs             list of the files generated by the build
+    """
+    # Compute the hashes from scratch since the files may have been changed or
+    # generated by the build.
+    self.fileHashes = dict();
+    depHashes = [[filename,self.FileHash(filename)] for filename in dependencies];
+    result = hashlib.sha1(json.dumps([self.key,depHashes])).hexdigest();
+    # Save the outputs, ensuring an incomplete result is never visible.
+    resultDir = self.ResultDir(result);
+    try:
+      if not os.path.isdir(resultDir):
+        self.MakeDirs(os.path.dirname(resultDir));
+        tmpDir = tempfile.mkdtemp(dir=os.path.dirname(resultDir));
+        for ix in range(len(outputs)):
+          shutil.copyfile(outputs[ix],os.path.join(tmpDir,'%d' % ix));
+        try:
+          os.rename(tmpDir,resultDir);
+        except OSError:
+          shutil.rmtree(tmpDir);
+      # Put this build at the start of the list of builds for the manifest.
+      entries = [entry for entry in self.ReadManifest() if entry['result'] != result];
+      entries.insert(0,dict(dependencies=depHashes, outputs=outputs, result=result));
+      self.MakeDirs(os.path.dirname(self.manifestName));
+      (fd,tmpName) = tempfile.mkstemp(dir=os.path.dirname(self.manifestName));
+      fp = os.fdopen(fd,'wt');
+      json.dump(dict(version=self.version, entries=entries[:self.maxEntries]),fp,sort_keys=True);
+      fp.close();
+      os.rename(tmpName,self.manifestName);
+    except (IOError,OSError), msg:
+      raise SSBCCException('Could not update build cache "%s":  %s' % (self.cacheDir,msg,));
+
+################################################################################
+#
+# Objects saved in the cache directory.
+#
+# Note:  These are intermediate results, such as the parsed processor core,
+#        that are named by a hash of their inputs.
+#
+################################################################################
+
+def ReadObject(cacheDir,name):
+  """
+  Return the object saved in the cache directory with the specified name or
+  None if there is no such object.
+  """
+  try:
+    fp = open(os.path.join(cacheDir,'objects','%s.pickle' % name),'rb');
+    obj = cPickle.load(fp);
+    fp.close();
+  except (IOError,EOFError,cPickle.UnpicklingError):
+    return None;
+  return obj;
+
+def WriteObject(cacheDir,name,obj):
+  """
+  Save the object in the cache directory with the specified name.
+  """
+  objectDir = os.path.join(cacheDir,'objects');
+  try:
+    try:
+      os.makedirs(objectDir);
+    except OSError:
+      if not os.path.isdir(objectDir):
+        raise;
+    (fd,tmpName) = tempfile.mkstemp(dir=objectDir);
+    fp = os.fdopen(fd,'wb');
+    cPickle.dump(obj,fp,cPickle.HIGHEST_PROTOCOL);
+    fp.close();
+    os.rename(tmpName,os.path.join(objectDir,'%s.pickle' % name));
+  except (IOError,OSError), msg:
+    raise SSBCCException('Could not update build cache "%s":  %s' % (cacheDir,msg,));
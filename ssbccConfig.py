@@ -1,6 +1,8 @@
 # Copyright 2012-2015, Sinclair R.F., Inc.
 # Utilities required by ssbcc.
 
+import hashlib
+import json
 import math
 import os
 import re
@@ -9,6 +11,29 @@ import sys
 from ssbccPeripheral import SSBCCinterruptPeripheral
 from ssbccUtil import *
 
+################################################################################
+#
+# Peripheral definitions.
+#
+# Note:  The definitions are retained so that a process doing a batch of builds
+#        executes each peripheral file only once.
+#
+################################################################################
+
+peripheralNamespaces = dict();
+
+def LoadPeripheral(fullperipheral):
+  """
+  Execute the peripheral Python script and return the dictionary with its
+  definitions.
+  """
+  mtime = os.path.getmtime(fullperipheral);
+  if (fullperipheral not in peripheralNamespaces) or (peripheralNamespaces[fullperipheral][0] != mtime):
+    namespace = dict(globals());
+    execfile(fullperipheral,namespace);
+    peripheralNamespaces[fullperipheral] = (mtime,namespace,);
+  return peripheralNamespaces[fullperipheral][1];
+
 class SSBCCconfig():
   """
   Container for ssbcc configuration commands, the associated parsing, and
@@ -20,17 +45,20 @@ class SSBCCconfig():
     Initialize the empty dictionaries holding the processor configuration
     parameters.  Initialize the paths to search for peripherals.
     """
+    self.asmDependencies = list();              # files read by the assembler
     self.config         = dict();               # various settings, etc.
     self.constants      = dict();               # CONSTANTs
     self.defines        = dict();               # defines
+    self.dependencies   = list();               # files read to build the processor
     self.functions      = dict();               # list of functions to define
     self.inports        = list();               # INPORT definitions
     self.ios            = list();               # List of I/Os
     self.outports       = list();               # OUTPORT definitions (see AddOutport)
     self.parameters     = list();               # PARAMETERs and LOCALPARAMs
     self.peripheral     = list();               # PERIPHERALs
+    self.programPending = False;                # assembled program not yet available
     self.signals        = list();               # internal signals
-    self.symbols        = list();               # constant, I/O, inport, etc.  names
+    self.symbols        = set();                # constant, I/O, inport, etc.  names
 
     # list of memories
     self.memories = dict(name=list(), type=list(), maxLength=list());
@@ -76,6 +104,15 @@ class SSBCCconfig():
       self.AddSymbol(name);
       self.defines[name] = 1;
 
+  def AddDependency(self,filename):
+    """
+    Record a file read while building the processor.\n
+    Note:  This is used by the build cache and by "--watch".  The files read by
+           the assembler are recorded in asmDependencies.
+    """
+    if filename not in self.dependencies:
+      self.dependencies.append(filename);
+
   def AddIO(self,name,nBits,iotype,loc):
     """
     Add an I/O signal to the processor interface to the system.\n
@@ -108,10 +145,10 @@ class SSBCCconfig():
     """
     self.memories['type'].append(cmd[0]);
     self.memories['name'].append(cmd[1]);
-    maxLength = eval(cmd[2]);
+    maxLength = EvalExpr(cmd[2]);
     if not IsPowerOf2(maxLength):
       raise SSBCCException('Memory length must be a power of 2, not "%s", at %s' % (cmd[2],loc,));
-    self.memories['maxLength'].append(eval(cmd[2]));
+    self.memories['maxLength'].append(maxLength);
 
   def AddOutport(self,port,loc):
     """
@@ -177,7 +214,7 @@ class SSBCCconfig():
         raise SSBCCException('Symbol "%s" already defined, no line number provided');
       else:
         raise SSBCCException('Symbol "%s" already defined before %s' % (name,loc,));
-    self.symbols.append(name);
+    self.symbols.add(name);
 
   def AppendIncludePath(self,path):
     """
@@ -252,8 +289,10 @@ class SSBCCconfig():
   def GetMemoryByBank(self,ixBank):
     """
     Return the parameters for a memory by its bank address.\n
-    ixBank      index of the requested memory bank
+    ixBank      index of the requested memory bank\n
+    Note:  The memory banks are assigned by the assembler.
     """
+    self.RequireProgram();
     if not 'bank' in self.memories:
       return None;
     if ixBank not in self.memories['bank']:
@@ -338,8 +377,10 @@ class SSBCCconfig():
            0 and it must have a non-empty body.\n
     Note:  Returning "None" when there is not interrupt address ensures both a
            "False" evaluation and that the value cannot be turned into an
-           integer for an address.
+           integer for an address.\n
+    Note:  The interrupt address is assigned by the assembler.
     """
+    self.RequireProgram();
     if not self.Exists('interruptAddress'):
       return None;
     else:
@@ -782,19 +823,14 @@ class SSBCCconfig():
       Find the peripheral in the candidate list of paths for peripherals.
       Execute the file declaring the peripheral.
         Note:  This is done since I couldn't find a way to "import" the
-               peripheral.  Executing the peripheral makes its definition local
-               to this invokation of the ProcessPeripheral function, but the
-               object subsequently created retains the required functionality
-               to instantiate the peripheral
+               peripheral.  The peripheral is executed in its own namespace
+               which is retained for subsequent instances of the peripheral.
       Go through the parameters for the peripheral and do the following for each:
         If the argument for the peripheral is the string "help", then print the
           docstring for the peripheral and exit.
         Append the parameter name and its argument to the list of parameters
           (use "None" as the argument if no argument was provided).
       Append the instantiated peripheral to the list of peripherals.
-        Note:  The "exec" function dynamically executes the instruction to
-               instantiate the peripheral and append it to the list of
-               peripherals.
     """
     # Validate the format of the peripheral configuration command and the the name of the peripheral.
     cmd = re.findall(r'\s*PERIPHERAL\s+(\w+)\s*(.*)$',line);
@@ -802,21 +838,25 @@ class SSBCCconfig():
       raise SSBCCException('Missing peripheral name in %s:  %s' % (loc,line[:-1],));
     peripheral = cmd[0][0];
     # Find and execute the peripheral Python script.
-    # Note:  Because "execfile" and "exec" method are used to load the
-    #        peripheral python script, the __file__ object is set to be this
-    #        file, not the peripheral source file.
+    # Note:  Because "execfile" is used to load the peripheral python script,
+    #        the __file__ object is set to be this file, not the peripheral
+    #        source file.
     for testPath in self.peripheralpaths:
       fullperipheral = os.path.join(testPath,'%s.py' % peripheral);
       if os.path.isfile(fullperipheral):
         break;
     else:
       raise SSBCCException('Peripheral "%s" not found' % peripheral);
-    execfile(fullperipheral);
+    self.AddDependency(fullperipheral);
+    buildProfile.StartStage('peripheral %s' % peripheral);
+    namespace = LoadPeripheral(fullperipheral);
+    if peripheral not in namespace:
+      raise SSBCCException('Peripheral "%s" not defined in %s' % (peripheral,fullperipheral,));
     # Convert the space delimited parameters to a list of tuples.
     param_list = list();
     for param_string in re.findall(r'(\w+="[^"]*"|\w+=\S+|\w+)\s*',cmd[0][1]):
       if param_string == "help":
-        exec('helpmsg = %s.__doc__' % peripheral);
+        helpmsg = namespace[peripheral].__doc__;
         if not helpmsg:
           raise SSBCCException('No help for peripheral %s is provided' % fullperipheral);
         print;
@@ -833,7 +873,16 @@ class SSBCCconfig():
       else:
         param_list.append((param_string,None));
     # Add the peripheral to the micro controller configuration.
-    exec('self.peripheral.append(%s(fullperipheral,self,param_list,loc));' % peripheral);
+    self.peripheral.append(namespace[peripheral](fullperipheral,self,param_list,loc));
+    buildProfile.EndStage();
+
+  def RequireProgram(self):
+    """
+    Raise SSBCCprogramPending if the assembled program, i.e., the interrupt
+    address, memory banks, and memory contents, is not yet available.
+    """
+    if self.programPending:
+      raise SSBCCprogramPending();
 
   def Set(self,name,value):
     """
@@ -883,6 +932,54 @@ class SSBCCconfig():
           self.memories[field].append(None);
       self.memories[field][index] = values[field];
 
+  def StructureFingerprint(self,snapshot):
+    """
+    Return a hash of the configuration that determines the structure of the
+    processor core, i.e., everything except the initial memory values.\n
+    snapshot    structure of the configuration from StructureSnapshot\n
+    Note:  This includes the memory banks assigned by the assembler and the
+           interrupt vector, so it must be computed after the assembler output
+           has been incorporated into the configuration.
+    """
+    assembled = dict(
+      interruptAddress=self.InterruptVector(),
+      memories=dict((field,self.memories[field]) for field in self.memories if field not in ('body','length',)),
+    );
+    return hashlib.sha1(snapshot + json.dumps(self.StructureValue(assembled),sort_keys=True)).hexdigest();
+
+  def StructureSnapshot(self):
+    """
+    Return the configuration that determines the structure of the processor
+    core, except for the values assigned by the assembler, as a string.\n
+    Note:  Generating the processor core modifies the configuration, so this must
+           be done before the core is generated.
+    """
+    structure = dict(
+      config=dict((key,self.config[key]) for key in self.config if key not in ('corepath','interruptAddress','rand_instr_mem',)),
+      functions=self.functions,
+      inports=self.inports,
+      ios=self.ios,
+      outports=self.outports,
+      parameters=self.parameters,
+      peripherals=[(p.__class__.__name__,dict((key,value) for (key,value) in vars(p).iteritems() if key != 'loadedFiles'),) for p in self.peripheral],
+      signals=self.signals,
+    );
+    return json.dumps(self.StructureValue(structure),sort_keys=True);
+
+  def StructureValue(self,value):
+    """
+    Convert the value to JSON-serializable lists, dicts, and scalars for
+    StructureSnapshot and StructureFingerprint.  Source locations are omitted
+    and objects are replaced by their type names.
+    """
+    if type(value) in (bool,int,long,float,str,unicode,) or value == None:
+      return value;
+    if type(value) in (list,tuple,):
+      return [self.StructureValue(v) for v in value];
+    if type(value) == dict:
+      return dict((str(key),self.StructureValue(value[key])) for key in value if key != 'loc');
+    return type(value).__name__;
+
   def SignalLengthList(self):
     """
     Generate a list of the I/O signals and their lengths.
@@ -0,0 +1,322 @@
+################################################################################
+#
+# Copyright 2015, Sinclair R.F., Inc.
+#
+# Reader for SSBCC configuration files.
+#
+################################################################################
+
+import math
+import os
+import re
+import sys
+
+from ssbccUtil import *;
+
+class SSBCCconfigReader:
+  """
+  Read an SSBCC configuration file and its included files into the processor
+  configuration.\n
+  The leading keyword of each configuration command is extracted once and used
+  to look up the method that processes the command.  The patterns used to
+  parse the commands are compiled when this module is loaded.
+  """
+
+  # Keyword at the start of a configuration command.
+  reKeyword = re.compile(r'\s*(\.?\w+)');
+
+  # Blank and comment lines.
+  reBlank = re.compile(r'\s*(#.*)?$');
+
+  # Patterns for the bodies of the configuration commands.
+  reARCHITECTURE        = re.compile(r'\s*ARCHITECTURE\s+(\S+)\s+(\S+)$');
+  reASSEMBLY            = re.compile(r'\s*ASSEMBLY\s+(\S.*)');
+  reCONSTANT            = re.compile(r'\s*CONSTANT\s+(C_\w+)\s+(\S+)\s*$');
+  reDATA_STACK          = re.compile(r'\s*DATA_STACK\s+([1-9]\d*)');
+  reEND_USER_HEADER     = re.compile(r'\s*END_USER_HEADER\b');
+  reIFDEF               = re.compile(r'\s*\.IFDEF\s+(\w+)\s*$');
+  reIFNDEF              = re.compile(r'\s*\.IFNDEF\s+(\w+)\s*$');
+  reINCLUDE             = re.compile(r'\s*\.INCLUDE\s+(\S+)\s*$');
+  reINSTRUCTION         = re.compile(r'\s*INSTRUCTION\s+([1-9]\d*\*?[1-9]?\d*)\s*$');
+  reINVERT_RESET        = re.compile(r'\s*INVERT_RESET\s*$');
+  reLOCALPARAM          = re.compile(r'\s*LOCALPARAM\s+(L_\w+)\s+(\S+)$');
+  reMEMORY              = re.compile(r'\s*MEMORY\s+(RAM|ROM)\s+([A-Za-z]\w*)\s+(\d+)\s*$');
+  rePARAMETER           = re.compile(r'\s*PARAMETER\s+(G_\w+)\s+(\S+)$');
+  rePORTCOMMENT         = re.compile(r'\s*PORTCOMMENT\s+(.*)');
+  reRETURN_STACK        = re.compile(r'\s*RETURN_STACK\s+([1-9]\d*)');
+  reSRAM_WIDTH          = re.compile(r'\s*SRAM_WIDTH\s+([1-9]\d*)');
+
+  # Configuration commands that are processed within disabled conditionals.
+  # Note:  ".INCLUDE" is one of these.
+  conditionalCommands = ('.ELSE','.ENDIF','.IFDEF','.IFNDEF','.INCLUDE',);
+
+  def __init__(self,config):
+    """
+    Initialize the reader for the processor configuration.
+    """
+    self.config = config;
+    self.compiler = list();
+    self.user_header = list();
+    self.handlers = {
+      '.ELSE'           : self.Process_ELSE,
+      '.ENDIF'          : self.Process_ENDIF,
+      '.IFDEF'          : self.Process_IFDEF,
+      '.IFNDEF'         : self.Process_IFNDEF,
+      '.INCLUDE'        : self.Process_INCLUDE,
+      'ARCHITECTURE'    : self.Process_ARCHITECTURE,
+      'ASSEMBLY'        : self.Process_ASSEMBLY,
+      'COMBINE'         : self.Process_COMBINE,
+      'CONSTANT'        : self.Process_CONSTANT,
+      'DATA_STACK'      : self.Process_DATA_STACK,
+      'INPORT'          : self.Process_INPORT,
+      'INSTRUCTION'     : self.Process_INSTRUCTION,
+      'INVERT_RESET'    : self.Process_INVERT_RESET,
+      'LOCALPARAM'      : self.Process_LOCALPARAM,
+      'MEMORY'          : self.Process_MEMORY,
+      'OUTPORT'         : self.Process_OUTPORT,
+      'PARAMETER'       : self.Process_PARAMETER,
+      'PERIPHERAL'      : self.Process_PERIPHERAL,
+      'PORTCOMMENT'     : self.Process_PORTCOMMENT,
+      'RETURN_STACK'    : self.Process_RETURN_STACK,
+      'SRAM_WIDTH'      : self.Process_SRAM_WIDTH,
+      'USER_HEADER'     : self.Process_USER_HEADER,
+    };
+
+  ##############################################################################
+  #
+  # Read the configuration file.
+  #
+  ##############################################################################
+
+  def Read(self,fpConfig):
+    """
+    Read the configuration file and the files it includes.\n
+    Note:  fpConfig is a file handle, so no paths will be searched by LoadFile.
+           This is ensured by setting config to None.
+    """
+    self.filename = fpConfig.name;
+    self.configList = LoadFile(fpConfig,None);
+    self.config.AddDependency(self.filename);
+    self.ixConfigList = 0;
+    self.ifstack = list();
+    self.configListStack = list();
+    bufLine = "";
+    while True:
+      # If the current file has ended, then proceed to the next file.
+      if self.ixConfigList == len(self.configList):
+        if not self.configListStack:
+          break;
+        if not len(bufLine) == 0:
+          raise SSBCCException('Malformed configuration command at the end of %s' % self.filename);
+        if self.ifstack:
+          raise SSBCCException('%d unmatched conditional(s) at end of %s' % (len(self.ifstack),self.filename,));
+        (self.filename,self.configList,self.ixConfigList,self.ifstack) = self.configListStack.pop();
+        continue;
+      # Get the next line to process and its line number.
+      (tmpLine,ixLine) = self.configList[self.ixConfigList];
+      self.ixConfigList += 1;
+      # Use the start line of a sequence of lines for error messages.
+      if not bufLine:
+        loc = '%s:%d' % (self.filename,ixLine,);
+      # Merge continuation lines.
+      bufLine += tmpLine;
+      if bufLine and bufLine[-1] == '\\':
+        bufLine = bufLine[:-1];
+        continue;
+      line = bufLine;
+      bufLine = "";
+      # Reject blank and comment lines
+      if self.reBlank.match(line):
+        continue;
+      # Look up the configuration command, consuming commands disabled by
+      # conditionals.
+      keyword = self.reKeyword.match(line);
+      keyword = keyword.group(1) if keyword else None;
+      if self.ifstack and not self.ifstack[-1] and keyword not in self.conditionalCommands:
+        continue;
+      if keyword not in self.handlers:
+        raise SSBCCException('Unrecognized configuration command at %s: "%s"' % (loc,line,));
+      self.handlers[keyword](loc,line);
+    if bufLine:
+      raise SSBCCException('Malformed last line(s): "%s"' % bufLine);
+    if self.ifstack:
+      raise SSBCCException('%d unmatched conditional(s) at end of %s' % (len(self.ifstack),self.filename,));
+
+  ##############################################################################
+  #
+  # Conditionals and included files.
+  #
+  ##############################################################################
+
+  def Process_ELSE(self,loc,line):
+    if not self.ifstack:
+      raise SSBCCException('unmatched ".ELSE" at %s' % loc);
+    self.ifstack[-1] = not self.ifstack[-1];
+
+  def Process_ENDIF(self,loc,line):
+    if not self.ifstack:
+      raise SSBCCException('unmatched ".ENDIF" at %s' % loc);
+    self.ifstack.pop();
+
+  def Process_IFDEF(self,loc,line):
+    cmd = self.reIFDEF.findall(line);
+    if not cmd:
+      raise SSBCCException('Malformed ".IFDEF" configuration command on %s' % loc);
+    self.ifstack.append(self.config.IsSymbol(cmd[0]));
+
+  def Process_IFNDEF(self,loc,line):
+    cmd = self.reIFNDEF.findall(line);
+    if not cmd:
+      raise SSBCCException('Malformed ".IFNDEF" configuration command on %s' % loc);
+    self.ifstack.append(not self.config.IsSymbol(cmd[0]));
+
+  def Process_INCLUDE(self,loc,line):
+    cmd = self.reINCLUDE.findall(line);
+    if not cmd:
+      raise SSBCCException('Malformed ".INCLUDE" configuration command on %s' % loc);
+    self.configListStack.append((self.filename,self.configList,self.ixConfigList,self.ifstack,));
+    self.filename = cmd[0];
+    self.configList = LoadFile(self.filename,self.config);
+    self.ixConfigList = 0;
+    self.ifstack = list();
+
+  ##############################################################################
+  #
+  # Configuration commands.
+  #
+  ##############################################################################
+
+  def Process_ARCHITECTURE(self,loc,line):
+    config = self.config;
+    if config.Exists('architecture'):
+      raise SSBCCException('ARCHITECTURE already specified before %s' % loc);
+    cmd = self.reARCHITECTURE.findall(line);
+    if not cmd:
+      raise SSBCCException('Malformed ARCHITECTURE configuration command at %s: "%s"' % (loc,line,));
+    cmd = cmd[0];
+    config.Set('architecture',cmd[0]);
+    config.Set('hdl',cmd[1]);
+    config.Set('corepath',os.path.join(sys.path[0],config.Get('architecture')));
+    if not os.path.isdir(config.Get('corepath')):
+      raise SSBCCException('Architecture "%s" does not exist at %s' % (cmd,loc,));
+    config.InsertPeripheralPath(os.path.join(config.Get('corepath'),'peripherals'));
+    # TODO -- move these assignments into an object
+    config.Set('data_width',8);
+
+  def Process_ASSEMBLY(self,loc,line):
+    cmd = self.reASSEMBLY.findall(line);
+    self.compiler = ('asm',cmd[0],);
+
+  def Process_COMBINE(self,loc,line):
+    self.config.ProcessCombine(loc,line);
+
+  def Process_CONSTANT(self,loc,line):
+    if not self.config.Exists('architecture'):
+      raise SSBCCException('"CONSTANT"s cannot be defined before the "ARCHITECTURE" is defined at %s' % loc);
+    cmd = self.reCONSTANT.findall(line);
+    if not cmd:
+      raise SSBCCException('Malformed "CONSTANT" configuration command on %s: "%s"' % (loc,line,));
+    cmd = cmd[0];
+    self.config.AddConstant(cmd[0],cmd[1],loc);
+
+  def Process_DATA_STACK(self,loc,line):
+    if self.config.Exists('data_stack'):
+      raise SSBCCException('DATA_STACK already defined before %s' % loc);
+    cmd = self.reDATA_STACK.findall(line);
+    if not cmd:
+      raise SSBCCException('Malformed "DATA_STACK" configuration command on %s: "%s"' % (loc,line,));
+    x = int(cmd[0]);
+    if math.modf(math.log(x,2))[0] != 0:
+      raise SSBCCException('DATA_STACK must be set to a power of 2, not %d, at %s' % (x,loc,));
+    if x < 8:
+      raise SSBCCException('DATA_STACK must be at least 8, not %d, at %s' % (x,loc,));
+    self.config.Set('data_stack',int(cmd[0]));
+
+  def Process_INPORT(self,loc,line):
+    if not self.config.Exists('architecture'):
+      raise SSBCCException('"INPORT"s cannot be defined before the "ARCHITECTURE" is defined at %s' % loc);
+    self.config.ProcessInport(loc,line);
+
+  def Process_INSTRUCTION(self,loc,line):
+    config = self.config;
+    if config.Exists('nInstructions'):
+      raise SSBCCException('INSTRUCTION already specified before %s' % loc);
+    cmd = self.reINSTRUCTION.findall(line);
+    if not cmd:
+      raise SSBCCException('Malformed "INSTRUCTION" configuration command at %s: "%s"' % (loc,line,));
+    config.SetMemoryBlock('nInstructions',cmd[0],(loc,line,));
+    # Ensure reasonable values
+    if config.Get('nInstructions')['length'] > 2**13:
+      raise SSBCCException('Instruction space cannot exceed %d at %s: "%s"' % (2**13,loc,line,));
+
+  def Process_INVERT_RESET(self,loc,line):
+    if not self.reINVERT_RESET.match(line):
+      raise SSBCCException('Unrecognized configuration command at %s: "%s"' % (loc,line,));
+    if (self.config.Exists('invertReset')):
+      raise SSBCCException('INVERT_RESET already specified before %s' % loc);
+    self.config.Set('invertReset',True);
+
+  def Process_LOCALPARAM(self,loc,line):
+    cmd = self.reLOCALPARAM.findall(line);
+    if (not cmd) or (len(cmd[0]) != 2):
+      raise SSBCCException('Malformed LOCALPARAM configuration command at %s: "%s"' % (loc,line,));
+    cmd = cmd[0];
+    self.config.AddParameter(cmd[0],cmd[1],loc);
+
+  def Process_MEMORY(self,loc,line):
+    config = self.config;
+    if not config.Exists('architecture'):
+      raise SSBCCException('"MEMORY"s cannot be defined before the "ARCHITECTURE" is defined at %s' % loc);
+    # TODO -- make the maximum number of memories architecture dependent
+    if config.NMemories() >= 4:
+      raise SSBCCException('Program is limited to 4 memories');
+    cmd = self.reMEMORY.findall(line);
+    if (not cmd) or (len(cmd[0]) != 3):
+      raise SSBCCException('Malformed MEMORY configuration command at %s: "%s"' % (loc,line,));
+    config.AddMemory(cmd[0],loc);
+
+  def Process_OUTPORT(self,loc,line):
+    if not self.config.Exists('architecture'):
+      raise SSBCCException('"OUTPORT"s cannot be defined before the "ARCHITECTURE" is defined at %s' % loc);
+    self.config.ProcessOutport(line,loc);
+
+  def Process_PARAMETER(self,loc,line):
+    cmd = self.rePARAMETER.findall(line);
+    if (not cmd) or (len(cmd[0]) != 2):
+      raise SSBCCException('Malformed PARAMETER configuration command at %s: "%s"' % (loc,line,));
+    cmd = cmd[0];
+    self.config.AddParameter(cmd[0],cmd[1],loc);
+
+  def Process_PERIPHERAL(self,loc,line):
+    if not self.config.Exists('architecture'):
+      raise SSBCCException('"PERIPHERAL"s cannot be defined before the "ARCHITECTURE" is defined at %s' % loc);
+    self.config.ProcessPeripheral(loc,line);
+
+  def Process_PORTCOMMENT(self,loc,line):
+    cmd = self.rePORTCOMMENT.findall(line);
+    self.config.AddIO(cmd[0],0,'comment',loc);
+
+  def Process_RETURN_STACK(self,loc,line):
+    if self.config.Exists('return_stack'):
+      raise SSBCCException('RETURN_STACK already specified before %s' % loc);
+    cmd = self.reRETURN_STACK.findall(line);
+    if not cmd:
+      raise SSBCCException('Malformed "RETURN_STACK" configuration command at %s: "%s"' % (loc,line,));
+    self.config.Set('return_stack',int(cmd[0]));
+
+  def Process_SRAM_WIDTH(self,loc,line):
+    if self.config.Exists('sram_width'):
+      raise SSBCCException('SRAM_WIDTH already specified before %s' % loc);
+    cmd = self.reSRAM_WIDTH.findall(line);
+    if not cmd:
+      raise SSBCCException('Malformed "SRAM_WIDTH" configuration command %s: "%s"' % (loc,line,));
+    self.config.Set('sram_width',int(cmd[0]));
+
+  def Process_USER_HEADER(self,loc,line):
+    while self.ixConfigList < len(self.configList):
+      (line,ixLine) = self.configList[self.ixConfigList];
+      self.ixConfigList += 1;
+      if self.reEND_USER_HEADER.match(line):
+        return;
+      self.user_header.append(line);
+    raise SSBCCException('No "END_USER_HEADER" found for "USER_HEADER" at %s' % loc);
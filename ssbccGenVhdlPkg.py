@@ -6,18 +6,19 @@
 
 import ssbccUtil
 
-def genVhdlPkg(config):
+def genVhdlPkgName(config):
+  """
+  Return the name of the VHDL Package file.
+  """
+  return '%s_pkg.vhd' % config.Get('outCoreName');
+
+def genVhdlPkg(fp,config):
   """
   Method to generate a VHDL Package file corresponding to the instantiated micro
   controller.
   """
   coreName = config.Get('outCoreName');
   packageName = '%s_pkg' % coreName;
-  packageFileName = '%s.vhd' % packageName;
-  try:
-    fp = open(packageFileName,'wt');
-  except:
-    raise SSBCCException('Could not open %s' % packageFileName);
   fp.write('library ieee;\n');
   fp.write('use ieee.std_logic_1164.all;\n');
   fp.write('package %s is\n' % packageName);
@@ -69,4 +70,3 @@ def genVhdlPkg(config):
   fp.write(');\n');
   fp.write('end component %s;\n' % coreName);
   fp.write('end package;\n');
-  fp.close();
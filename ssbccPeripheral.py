@@ -116,8 +116,17 @@ class SSBCCperipheral:
     fp = open(hdlName,'rt');
     body = fp.read();
     fp.close();
+    if hdlName not in self.LoadedFiles():
+      self.__dict__.setdefault('loadedFiles',list()).append(hdlName);
     return body;
 
+  def LoadedFiles(self):
+    """
+    Return the list of HDL files read by LoadCore.\n
+    Note:  This is used by the build cache.
+    """
+    return self.__dict__.get('loadedFiles',list());
+
   ##############################################################################
   #
   # Methods to supplement python intrisics for the optFn argument of AddAttr
@@ -282,3 +291,9 @@ def InterruptPeripheralAssigned():
   Indicate whether or not an interrupt peripheral has been generated.
   """
   return True if SSBCCinterruptPeripheral.instance else False;
+
+def ResetInterruptPeripheral():
+  """
+  Forget the interrupt peripheral before building another processor.
+  """
+  SSBCCinterruptPeripheral.instance = None;
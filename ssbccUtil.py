@@ -6,9 +6,13 @@
 #
 ################################################################################
 
+import ast
+import json
 import math
 import os
 import re
+import tempfile
+import time
 
 ################################################################################
 #
@@ -25,6 +29,114 @@ class SSBCCException(Exception):
   def __str__(self):
     return self.message;
 
+class SSBCCprogramPending(Exception):
+  """
+  Exception raised when part of the processor core requires the assembled
+  program before the assembler has finished.\n
+  Note:  ssbcc generates the parts of the core that don't depend on the program
+         while the assembler runs and defers the parts that raise this
+         exception until the program is available.
+  """
+  pass;
+
+class SSBCCprofile:
+  """
+  Record the wall and CPU times of the stages of a build.\n
+  Stages are started and ended by StartStage and EndStage and can be nested.
+  Nothing is recorded until Start is called.
+  """
+
+  def __init__(self):
+    self.active = False;
+
+  def Times(self):
+    """
+    Return the wall time and the CPU time used by this process.\n
+    Note:  The resource module, which has a finer resolution than os.times, is
+           only available on Unix-like systems.
+    """
+    try:
+      import resource
+      usage = resource.getrusage(resource.RUSAGE_SELF);
+      return (time.time(),usage.ru_utime+usage.ru_stime,);
+    except ImportError:
+      cpuTimes = os.times();
+      return (time.time(),cpuTimes[0]+cpuTimes[1],);
+
+  def Start(self):
+    """
+    Start recording the stages.
+    """
+    self.active = True;
+    self.stages = list();
+    self.openStages = list();
+    self.startTimes = self.Times();
+
+  def StartStage(self,name):
+    """
+    Start the named stage.
+    """
+    if not self.active:
+      return;
+    stage = dict(name=name, depth=len(self.openStages));
+    self.stages.append(stage);
+    self.openStages.append((stage,self.Times(),));
+
+  def EndStage(self):
+    """
+    End the most recently started stage.
+    """
+    if not self.active:
+      return;
+    (stage,startTimes) = self.openStages.pop();
+    endTimes = self.Times();
+    stage['start'] = startTimes[0] - self.startTimes[0];
+    stage['wall'] = endTimes[0] - startTimes[0];
+    stage['cpu'] = endTimes[1] - startTimes[1];
+
+  def Stop(self,reportName,**kwargs):
+    """
+    Stop recording and write the JSON report to the specified file.\n
+    Stages that were not ended, because the build failed, are ended here and
+    marked as incomplete.  The keyword arguments are included in the report.
+    """
+    if not self.active:
+      return;
+    while self.openStages:
+      self.openStages[-1][0]['incomplete'] = True;
+      self.EndStage();
+    endTimes = self.Times();
+    self.active = False;
+    report = dict(kwargs);
+    report['wall'] = endTimes[0] - self.startTimes[0];
+    report['cpu'] = endTimes[1] - self.startTimes[1];
+    report['stages'] = self.stages;
+    try:
+      fp = open(reportName,'wt');
+      json.dump(report,fp,indent=2,sort_keys=True);
+      fp.write('\n');
+      fp.close();
+    except IOError:
+      raise SSBCCException('Error writing profile "%s"' % reportName);
+
+# Profile shared by ssbcc and the in-process assembler.
+buildProfile = SSBCCprofile();
+
+# Functions and syntax allowed in the expressions evaluated by EvalExpr.
+exprFunctions = ('abs','int','len','max','min','ord',);
+exprNodes = (
+  ast.Expression,
+  ast.BinOp, ast.BoolOp, ast.Compare, ast.IfExp, ast.UnaryOp,
+  ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+  ast.LShift, ast.RShift, ast.BitOr, ast.BitXor, ast.BitAnd,
+  ast.UAdd, ast.USub, ast.Invert, ast.Not, ast.And, ast.Or,
+  ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+  ast.Num, ast.Str, ast.Name, ast.Load, ast.Call, ast.Subscript, ast.Index,
+);
+
+# Compiled expressions indexed by the text of the expression.
+exprCache = dict();
+
 ################################################################################
 #
 # Methods
@@ -47,6 +159,54 @@ def CeilPow2(v):
   """
   return 2**CeilLog2(v);
 
+def CompileExpr(expression):
+  """
+  Parse and check the expression and return its compiled form.\n
+  The expression can only use numbers, strings, names, the arithmetic, bitwise,
+  comparison, and boolean operators, conditional expressions, "size[...]", and
+  calls to the functions listed in exprFunctions.\n
+  Note:  Each expression is parsed and checked once and its compiled form is
+         cached by the text of the expression.
+  """
+  if expression not in exprCache:
+    try:
+      tree = ast.parse(expression.lstrip(' \t'),mode='eval');
+    except SyntaxError:
+      raise SSBCCException('Malformed expression "%s"' % expression);
+    for node in ast.walk(tree):
+      if not isinstance(node,exprNodes):
+        raise SSBCCException('Illegal operation in expression "%s"' % expression);
+      if isinstance(node,ast.Call):
+        if not isinstance(node.func,ast.Name) or node.func.id not in exprFunctions \
+           or node.keywords or node.starargs or node.kwargs:
+          raise SSBCCException('Illegal function call in expression "%s"' % expression);
+      elif isinstance(node,ast.Subscript):
+        if not isinstance(node.value,ast.Name) or node.value.id != 'size':
+          raise SSBCCException('Illegal subscript in expression "%s"' % expression);
+      elif isinstance(node,ast.Name):
+        if node.id.startswith('__'):
+          raise SSBCCException('Illegal name in expression "%s"' % expression);
+    exprCache[expression] = compile(tree,'<expression>','eval');
+  return exprCache[expression];
+
+def EvalExpr(expression,namespace=None):
+  """
+  Evaluate the expression using the optional dict for the values of the names
+  in the expression (see CompileExpr for the allowed syntax).
+  """
+  code = CompileExpr(expression);
+  try:
+    return eval(code,namespace if namespace != None else dict());
+  except Exception, msg:
+    raise SSBCCException('Cannot evaluate expression "%s":  %s' % (expression,msg,));
+
+def ExprNames(expression):
+  """
+  Return the tuple of the names used in the expression, including "size" and
+  the names of the functions.
+  """
+  return CompileExpr(expression).co_names;
+
 def ExtractBits(v,bits):
   """
   Extract the bits specified by bits from v.
@@ -161,6 +321,7 @@ def LoadFile(filename,config):
           fp = file(fullfilename);
         except:
           raise SSBCCException('Error opening "%s"' % filename);
+        config.AddDependency(fullfilename);
         break;
     else:
       raise SSBCCException('.INCLUDE file "%s" not found' % filename);
@@ -190,7 +351,42 @@ def ParseIntExpr(value):
     return value;
   if not IsIntExpr(value):
     raise Exception('Program Bug -- shouldn\'t call with a badly formatted integer expression');
-  return eval(re.sub('_','',value));
+  return EvalExpr(re.sub('_','',value));
+
+def WriteIfChanged(filename,body):
+  """
+  Write the body to the file if the file doesn't already have that content and
+  return True if the file was written.\n
+  Note:  Unchanged files are not touched so that their modification times
+         don't trigger downstream synthesis and simulation.\n
+  Note:  The file is replaced atomically so that an interrupted build never
+         leaves a partially written file.
+  """
+  try:
+    fp = open(filename,'rt');
+    oldBody = fp.read();
+    fp.close();
+    if oldBody == body:
+      return False;
+    mode = os.stat(filename).st_mode & 0777;
+  except (IOError,OSError):
+    umask = os.umask(0);
+    os.umask(umask);
+    mode = 0666 & ~umask;
+  try:
+    (fd,tmpName) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)));
+    try:
+      fp = os.fdopen(fd,'wt');
+      fp.write(body);
+      fp.close();
+      os.chmod(tmpName,mode);
+      os.rename(tmpName,filename);
+    except:
+      os.remove(tmpName);
+      raise;
+  except (IOError,OSError), msg:
+    raise SSBCCException('Error writing "%s":  %s' % (filename,msg,));
+  return True;
 
 ################################################################################
 #
@@ -211,4 +407,24 @@ if __name__ == "__main__":
     Test_ExtractBits(v,'[4+:6]',(v/16)%64);
     Test_ExtractBits(v,'[9:4]',(v/16)%64);
 
+  for (expression,vExpect) in (
+      ('2**4-1',15),
+      ('int(100.e6/400.e3/3)-1',82),
+      ("ord('A')-ord('9')-1",7),
+      ('max(1,(63-9+2)/3)',18),
+      ("size['ram']/2",8),
+      ('C_X|0x01 if C_X > 0 else 0',5),
+    ):
+    vGot = EvalExpr(expression,dict(C_X=4,size=dict(ram=16)));
+    if vGot != vExpect:
+      raise Exception('EvalExpr failed:  "%s" ==> %s instead of %s' % (expression,vGot,vExpect,));
+  for expression in ('__import__("os")','open("x")','size.clear()','(lambda:0)()','C_X.real','[1][0]',):
+    try:
+      EvalExpr(expression,dict(C_X=4,size=dict()));
+    except SSBCCException:
+      continue;
+    raise Exception('EvalExpr accepted "%s"' % expression);
+  if set(ExprNames("C_X+size['ram']*max(C_Y,1)")) != set(['C_X','C_Y','max','size']):
+    raise Exception('ExprNames failed');
+
   print 'Unit test passed';